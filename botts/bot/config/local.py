@@ -13,6 +13,8 @@ BOT_TOKEN = config['bot']['token']
 DEBUG_BOT_TOKEN = config['bot']['debug_token']
 ADMIN_ID = config['bot']['admin_id']
 
+INVOKER_CONFIG = config.get('invoker', {})
+
 BOT = Bot(BOT_TOKEN if not DEBUG_MODE else DEBUG_BOT_TOKEN)
 
 
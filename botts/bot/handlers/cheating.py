@@ -307,7 +307,7 @@ async def handle_run_id(message: Message, state: FSMContext, bot: Bot):
     run: Run = Run.get_by_id(run_id)
     students_used = set()
     
-    for run in Run.select().where(Run.solution_hash == run.solution_hash):
+    for run in Cheating.runs_by_hash(run.task_id, run.solution_hash):
         sub = Submission.get_by_id(run.submission_id)
         student = Student.get_by_id(sub.student_id)
         if student.id_ in students_used:
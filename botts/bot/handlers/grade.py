@@ -26,6 +26,7 @@ from botts.testsys.components.base.task import Task
 from botts.testsys.components.check.checker import Result, Verdict
 from botts.testsys.components.extract.jupyter import NotebookContainer
 from botts.testsys.components.test.event import Event
+from botts.testsys.components.test.scheduler import GRADING_SCHEDULER, Priority, QueueFull
 
 grade_router = Router()
 
@@ -154,9 +155,14 @@ async def _grade(
     event_id = (await state.get_data())['event_id']
     event = Event.ALL[event_id]
     batch_size = max(len(event.tasks) // 10, 1)
-    reply = await message.reply('Ok, тестируется...')
+    try:
+        ticket = GRADING_SCHEDULER.submit(Priority.INTERACTIVE, author.id_)
+    except QueueFull:
+        await message.reply('Слишком много посылок в очереди, попробуйте отправить решение позже')
+        await state.clear()
+        return
+    queued = ticket.queued
     chat_action = ChatActionSender.typing(bot=bot, chat_id=message.from_user.id)
-    await chat_action.__aenter__()
 
     def build_response(header: str, results: dict[str, Result]) -> str:
         def task_status(task: Task, result: Result):
@@ -189,19 +195,38 @@ async def _grade(
         await chat_action.__aexit__(*sys.exc_info())
         await state.clear()
 
-    await state.set_state(GradeState.TESTING)
-    submission = Submission.create(
-        timestamp=time.time(),
-        event=event_id,
-        student=author,
-        file_path=file_path,
-        message_id=reply.message_id
-    )
-    loop = asyncio.get_running_loop()
-    loop.create_task(Event.ALL[event_id].run(
-        container, submission,
-        callback, final_callback
-    ))
+    async def run(submission: Submission):
+        async with ticket:
+            if queued:
+                try:
+                    await reply.edit_text('Ok, тестируется...')
+                except TelegramAPIError:
+                    pass
+            await Event.ALL[event_id].run(
+                container, submission,
+                callback, final_callback
+            )
+
+    # Until the background run owns the ticket, any failure has to give its slot back
+    try:
+        reply = await message.reply(
+            f'Ok, в очереди на тестирование, перед вами посылок: {ticket.position}' if queued
+            else 'Ok, тестируется...'
+        )
+        await chat_action.__aenter__()
+        await state.set_state(GradeState.TESTING)
+        submission = Submission.create(
+            timestamp=time.time(),
+            event=event_id,
+            student=author,
+            file_path=file_path,
+            message_id=reply.message_id
+        )
+        loop = asyncio.get_running_loop()
+        loop.create_task(run(submission))
+    except BaseException:
+        ticket.cancel()
+        raise
 
 
 @grade_router.message(GradeState.CODE)
@@ -264,21 +289,14 @@ async def handle_event_status(query: CallbackQuery, state: FSMContext, _student:
     event_id = data.option
     event = Event.ALL[event_id]
 
-    submissions = (Submission
-                   .select(Submission)
-                   .join(Student)
-                   .where((Student.id_ == _student.id_) & (Submission.event == event_id)))
-    submission_ids = submissions.select(Submission.id_)
+    runs_by_task: dict[str, list[Run]] = {}
+    for run in Students.event_runs(_student.id_, event_id):
+        runs_by_task.setdefault(run.task_id, []).append(run)
     await query.answer('Ok!')
 
     def task_status(task: Task):
-        runs = (Run
-                .select(Run)
-                .join(Submission)
-                .where(Submission.id_.in_(submission_ids) & (Run.task_id == task.id_))
-                .order_by(Submission.timestamp)).execute()
         verdicts = []
-        for run in runs:
+        for run in runs_by_task.get(task.id_, []):
             if run.verdict == Verdict.OK.name:
                 return emoji.emojize(':small_blue_diamond:') + f' _{task.id_}_: `OK`'
             verdicts.append(f'`{run.verdict}`')
@@ -20,6 +20,7 @@ from botts.db.util.filter import DBFilter
 from botts.testsys.components.check.checker import Result, Verdict
 from botts.testsys.components.test.event import Event
 from botts.testsys.components.test.runner import Runner
+from botts.testsys.components.test.scheduler import GRADING_SCHEDULER
 
 master_router = Router()
 
@@ -113,6 +114,21 @@ async def edit_runs(message: Message, state: FSMContext, page: int, filters: lis
     })
 
 
+@master_router.message(Command('queue'))
+@flags.teacher(True)
+async def handle_queue(message: Message):
+    stats = GRADING_SCHEDULER.stats()
+    await message.reply(
+        f'*Grading queue*: {stats["running"]}/{stats["concurrency"]} running\n' + '\n'.join([
+            f' · _{name}_: `{item["queued"]}` queued from {item["owners"]}, '
+            f'oldest {item["oldest"]:.1f}s, wait {item["mean_wait"]:.1f}s avg / {item["max_wait"]:.1f}s max, '
+            f'{item["granted"]} started'
+            for name, item in stats['classes'].items()
+        ]),
+        parse_mode='Markdown'
+    )
+
+
 @master_router.callback_query(RunCallback.filter(), MasterState.RUNS_LIST)
 async def handle_run(query: CallbackQuery, bot: Bot):
     data = RunCallback.unpack(query.data)
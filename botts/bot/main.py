@@ -4,6 +4,7 @@ from aiogram import Dispatcher
 
 from tgutils.middleware.logging import LoggingMiddleware, DEFAULT_FIELD_RULES
 
+from botts.testsys.components.test.invoker_pool import INVOKER_POOL
 from common.logging import setup_logging
 from .config.local import BOT
 
@@ -37,6 +38,9 @@ dispatcher.message.middleware(AuthorizationMiddleware())
 dispatcher.message.middleware(TestingWall())
 dispatcher.message.middleware(FormattingMiddleware())
 
+dispatcher.startup.register(INVOKER_POOL.start)
+dispatcher.shutdown.register(INVOKER_POOL.stop)
+
 
 async def main():
     import botts.testsys.config.contests.y2024.c00_introduction as intro
@@ -0,0 +1,20 @@
+from peewee import BlobField, CharField, Model, TimestampField
+
+from . import database
+
+
+class CachedAnswer(Model):
+    key = CharField(primary_key=True)
+    task_id = CharField()
+    value = BlobField()
+    used = TimestampField()
+
+    class Meta:
+        database = database
+        indexes = (
+            (('used',), False),
+        )
+        table_name = 'cached_answer'
+
+
+database.create_tables([CachedAnswer], safe=True)
@@ -0,0 +1,23 @@
+from peewee import CharField, FloatField, IntegerField, Model, TimestampField
+
+from . import database
+
+
+class CachedVerdict(Model):
+    key = CharField(primary_key=True)
+    task_id = CharField()
+    verdict = CharField()
+    comment = CharField(null=True)
+    max_rss = IntegerField(null=True)
+    cpu_time = FloatField(null=True)
+    used = TimestampField()
+
+    class Meta:
+        database = database
+        indexes = (
+            (('used',), False),
+        )
+        table_name = 'cached_verdict'
+
+
+database.create_tables([CachedVerdict], safe=True)
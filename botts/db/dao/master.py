@@ -29,37 +29,48 @@ class Master:
                  .where(DBFilter.join_filters(filters)))
         return query.count()
 
+    @staticmethod
+    def page(limit: int | None, offset: int | None, *filters: DBFilter):
+        # Walks submission(timestamp) in order, so only the requested page is read and nothing is sorted
+        return (Master
+                ._base()
+                .where(DBFilter.join_filters(filters))
+                .order_by(Submission.timestamp)
+                .limit(limit)
+                .offset(offset))
+
     @staticmethod
     def runs(limit: int | None, offset: int | None, *filters: DBFilter):
-        query = (Master
-                 ._base()
-                 .where(DBFilter.join_filters(filters))
-                 .order_by(Submission.timestamp)
-                 .limit(limit)
-                 .offset(offset))
-        return query.execute()
+        return Master.page(limit, offset, *filters).execute()
 
 
 class Cheating:
+    STUDENT_MATCHES = textwrap.dedent('''
+        select s.id_, s.name, run.task_id, run.id_
+        from run
+            join student s on s.id_ = run.student_id
+        where
+            run.verdict = 'OK' and
+            run.student_id != ? and
+            (run.task_id, run.solution_hash) in (
+                select task_id, solution_hash
+                from run
+                where student_id = ? and
+                verdict = 'OK'
+            )
+    ''')
+    TASK_GROUPS = textwrap.dedent('''
+        select task_id, group_concat(distinct student_id), group_concat(id_), count(distinct student_id) c
+        from run
+        where verdict = 'OK' and
+            task_id = ?
+        group by event, task_id, solution_hash
+        having c > 1;
+    ''')
+
     @staticmethod
     def student_matches(student_id: int) -> dict[tuple[int, str], list[int, str]]:
-        cursor = database.execute_sql(textwrap.dedent('''
-            select s.id_, s.name, run.task_id, run.id_
-            from run
-                join submission sub on sub.id_ = run.submission_id
-                join student s on s.id_ = sub.student_id
-            where
-                run.verdict = 'OK' and
-                s.id_ != ? and
-                (run.task_id, run.solution_hash) in (
-                    select run.task_id, run.solution_hash
-                    from run
-                        join submission sub on sub.id_ = run.submission_id
-                        join student s on s.id_ = sub.student_id
-                    where s.id_ = ? and
-                    run.verdict = 'OK'
-                )
-        '''), (student_id, student_id))
+        cursor = database.execute_sql(Cheating.STUDENT_MATCHES, (student_id, student_id))
         
         matches = {}
         for row in cursor.fetchall():
@@ -71,28 +82,21 @@ class Cheating:
             
         return matches
     
+    @staticmethod
+    def runs_by_hash(task_id: str, solution_hash: str):
+        return (Run.select()
+                .where((Run.task_id == task_id) & (Run.solution_hash == solution_hash)))
+
     @staticmethod
     def get_run_by_hash(student_id: int, task_id: str, solution_hash: str) -> Run:
-        query = (Run.select()
-                 .join(Submission)
-                 .join(Student)
-                 .where((Student.id_ == student_id) & 
-                        (Run.task_id == task_id) & 
-                        (Run.solution_hash == solution_hash)))
+        query = (Cheating
+                 .runs_by_hash(task_id, solution_hash)
+                 .where(Run.student_id == student_id))
         return query.first()
     
     @staticmethod
     def task_groups(task_id: int):
-        cursor = database.execute_sql(textwrap.dedent('''
-            select run.task_id, group_concat(distinct s.id_), group_concat(run.id_), count(distinct s.id_) c
-            from run
-                join submission sub on sub.id_ = run.submission_id
-                join student s on s.id_ = sub.student_id
-            where verdict = 'OK' and
-                task_id = ?
-            group by sub.event, run.task_id, run.solution_hash
-            having c > 1;
-        '''), (task_id,))
+        cursor = database.execute_sql(Cheating.TASK_GROUPS, (task_id,))
         
         return list(cursor.fetchall())
 
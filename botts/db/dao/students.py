@@ -2,7 +2,9 @@ import time
 from typing import Sequence
 
 from ..ban import Ban
+from ..run import Run
 from ..student import Student
+from ..submission import Submission
 from ..tg_user import TGUser
 
 
@@ -30,6 +32,15 @@ class Students:
                  .where(Student.name.startswith(name_prefix)))
         return query.execute()
 
+    @staticmethod
+    def event_runs(student_id: int, event_id: str):
+        query = (Run
+                 .select(Run)
+                 .join(Submission)
+                 .where((Submission.student == student_id) & (Submission.event == event_id))
+                 .order_by(Submission.timestamp))
+        return query
+
     @staticmethod
     def update_tg_data(student: Student, tg_id: int, username: str | None):
         query = (TGUser
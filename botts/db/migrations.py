@@ -0,0 +1,27 @@
+from peewee import CharField, IntegerField
+from playhouse.migrate import SqliteMigrator, migrate
+
+from . import database
+
+
+def denormalize_run():
+    """Adds the submission's `student_id` and `event` to a `run` table created before they were introduced"""
+    if not database.table_exists('run'):
+        return
+    columns = {column.name for column in database.get_columns('run')}
+    migrator = SqliteMigrator(database)
+    operations = []
+    if 'student_id' not in columns:
+        operations.append(migrator.add_column('run', 'student_id', IntegerField(null=True)))
+    if 'event' not in columns:
+        operations.append(migrator.add_column('run', 'event', CharField(null=True)))
+    if len(operations) == 0:
+        return
+
+    with database.atomic():
+        migrate(*operations)
+        database.execute_sql(
+            'update run set '
+            'student_id = (select student_id from submission where submission.id_ = run.submission_id), '
+            'event = (select event from submission where submission.id_ = run.submission_id)'
+        )
@@ -1,6 +1,7 @@
 from peewee import AutoField, CharField, ForeignKeyField, IntegerField, Model
 
 from . import database
+from .migrations import denormalize_run
 from .submission import Submission
 
 
@@ -17,13 +18,19 @@ class Run(Model):
         Submission, backref='runs', field='id_',
         lazy_load=False
     )
+    # Copies of the submission's columns, so that per-student lookups don't need a join
+    student_id = IntegerField(null=True)
+    event = CharField(null=True)
 
     class Meta:
         database = database
         indexes = (
             (('submission_id', 'task_id'), True),
+            (('task_id', 'solution_hash', 'verdict', 'student_id'), False),
+            (('student_id', 'verdict', 'task_id', 'solution_hash'), False),
         )
         table_name = 'run'
 
 
+denormalize_run()
 database.create_tables([Run], safe=True)
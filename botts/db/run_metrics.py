@@ -0,0 +1,51 @@
+import math
+import struct
+from typing import Any
+
+from peewee import BlobField, FloatField, ForeignKeyField, IntegerField, Model
+
+from . import database
+from .run import Run
+
+# Per-test record: test index, CPU time (s), wall time (s), peak RSS (KiB)
+TEST_USAGE = struct.Struct('<IffI')
+
+
+def pack_tests(usage: dict[int, dict[str, Any]]) -> bytes:
+    return b''.join(
+        TEST_USAGE.pack(
+            i,
+            test.get('cpu_time', math.nan),
+            test.get('wall_time', math.nan),
+            test.get('max_rss', 0)
+        )
+        for i, test in sorted(usage.items())
+    )
+
+
+class RunMetrics(Model):
+    run = ForeignKeyField(
+        Run, backref='metrics', field='id_',
+        primary_key=True, on_delete='CASCADE',
+        lazy_load=False
+    )
+    tests = IntegerField()
+    cpu_time = FloatField(null=True)
+    max_cpu_time = FloatField(null=True)
+    wall_time = FloatField()
+    max_rss = IntegerField(null=True)
+    bytes_in = IntegerField()
+    bytes_out = IntegerField()
+    queue_wait = FloatField()
+    per_test = BlobField()
+
+    @property
+    def test_usage(self) -> list[tuple[int, float, float, int]]:
+        return list(TEST_USAGE.iter_unpack(self.per_test))
+
+    class Meta:
+        database = database
+        table_name = 'run_metrics'
+
+
+database.create_tables([RunMetrics], safe=True)
@@ -17,6 +17,10 @@ class Submission(Model):
 
     class Meta:
         database = database
+        indexes = (
+            (('student_id', 'event', 'timestamp'), False),
+            (('timestamp',), False),
+        )
         table_name = 'submission'
 
 
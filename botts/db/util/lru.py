@@ -0,0 +1,31 @@
+import time
+from typing import Any
+
+from peewee import Model
+
+
+class LruTable:
+    """Bounded cache table keyed by `key`, rows that were not `used` recently are pruned once in a while"""
+
+    MAX_ENTRIES = 100_000
+    PRUNE_EVERY = 1000
+
+    def __init__(self, model: type[Model]):
+        self.model = model
+        self.inserted = 0
+
+    def get(self, key: str) -> Model | None:
+        entry = self.model.get_or_none(self.model.key == key)
+        if entry is not None:
+            self.model.update(used=int(time.time())).where(self.model.key == key).execute()
+        return entry
+
+    def put(self, key: str, **values: Any):
+        self.model.replace(key=key, used=int(time.time()), **values).execute()
+        self.inserted += 1
+        if self.inserted % LruTable.PRUNE_EVERY == 0:
+            self.prune()
+
+    def prune(self):
+        recent = self.model.select(self.model.key).order_by(self.model.used.desc()).limit(LruTable.MAX_ENTRIES)
+        self.model.delete().where(self.model.key.not_in(recent)).execute()
@@ -0,0 +1,59 @@
+import re
+import sys
+
+from botts.db import database
+from botts.db.dao.master import Cheating, Master
+from botts.db.dao.students import Students
+from botts.db.run import Run
+
+# Hot queries may only reach a table through an index lookup, never by scanning the table or a whole index
+TABLE_STEP = re.compile(r'^(SCAN|SEARCH) ')
+INDEXED = re.compile(r'^SEARCH \S+ USING (COVERING INDEX|INDEX|INTEGER PRIMARY KEY) ')
+INDEX_ONLY = re.compile(r'^SEARCH \S+ USING (COVERING INDEX|INTEGER PRIMARY KEY) ')
+# Paged listings may walk an index in the requested order, LIMIT stops the walk after one page
+ORDERED = re.compile(r'^SCAN \S+ USING (COVERING )?INDEX ')
+SORT = re.compile(r'^USE TEMP B-TREE FOR (RIGHT PART OF )?ORDER BY')
+
+
+def hot_queries() -> dict[str, tuple[str, list, bool, bool]]:
+    """
+    Query name to its SQL, sample parameters, whether it has to be answered from indexes alone
+    and whether it is a paged listing
+    """
+    return {
+        'student_matches': (Cheating.STUDENT_MATCHES, [1, 1], True, False),
+        'task_groups': (Cheating.TASK_GROUPS, ['task'], False, False),
+        'runs_by_hash': (*Cheating.runs_by_hash('task', 'hash').sql(), False, False),
+        'get_run_by_hash': (*Cheating.runs_by_hash('task', 'hash').where(Run.student_id == 1).sql(), False, False),
+        'event_runs': (*Students.event_runs(1, 'event').sql(), False, False),
+        'master_runs': (*Master.page(20, 0).sql(), False, True),
+    }
+
+
+def query_plan(sql: str, params: list) -> list[str]:
+    return [row[-1] for row in database.execute_sql(f'explain query plan {sql}', params).fetchall()]
+
+
+def violations(plan: list[str], index_only: bool, paged: bool = False) -> list[str]:
+    allowed = INDEX_ONLY if index_only else INDEXED
+    return [
+        step for step in plan
+        if TABLE_STEP.match(step) and not allowed.match(step) and not (paged and ORDERED.match(step))
+        or SORT.match(step)
+    ]
+
+
+def check() -> bool:
+    ok = True
+    for name, (sql, params, index_only, paged) in hot_queries().items():
+        plan = query_plan(sql, params)
+        bad = violations(plan, index_only, paged)
+        ok = ok and len(bad) == 0
+        print(f'{"FAIL" if bad else "ok"} {name}')
+        for step in plan:
+            print(f'    {"!" if step in bad else " "} {step}')
+    return ok
+
+
+if __name__ == '__main__':
+    sys.exit(0 if check() else 1)
@@ -0,0 +1,50 @@
+import ast
+import logging
+
+from botts.db import database
+from botts.db.run import Run
+from botts.testsys.components.base.fingerprint import fingerprint
+
+BATCH_SIZE = 500
+
+
+def solution_node(source: str) -> ast.AST | None:
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return None
+    for node in ast.walk(tree):
+        if isinstance(node, ast.FunctionDef):
+            return node
+    return tree
+
+
+def rehash() -> int:
+    """One-time backfill of `run.solution_hash` computed with the salted builtin `hash()`"""
+    logger = logging.getLogger('rehash')
+    updated, last_id = 0, 0
+    while True:
+        runs = list(Run
+                    .select(Run.id_, Run.solution_source, Run.solution_hash)
+                    .where(Run.id_ > last_id)
+                    .order_by(Run.id_)
+                    .limit(BATCH_SIZE))
+        if len(runs) == 0:
+            break
+        last_id = runs[-1].id_
+        with database.atomic():
+            for run in runs:
+                if (node := solution_node(run.solution_source)) is None:
+                    logger.warning(f'Run {run.id_} can not be parsed, keeping its hash')
+                    continue
+                solution_hash = fingerprint(node)
+                if solution_hash != run.solution_hash:
+                    Run.update(solution_hash=solution_hash).where(Run.id_ == run.id_).execute()
+                    updated += 1
+        logger.info(f'Rehashed runs up to {last_id}, {updated} updated')
+    return updated
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    print(f'{rehash()} runs updated')
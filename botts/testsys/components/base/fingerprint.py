@@ -0,0 +1,104 @@
+import ast
+import copy
+import hashlib
+
+
+class _Normalizer(ast.NodeTransformer):
+    """
+    Brings structurally equal solutions to the same tree: names bound inside the solution are renamed
+    in order of appearance, docstrings are dropped and, optionally, literals are replaced by their types.
+    Comments never make it into the AST in the first place.
+    """
+
+    def __init__(self, bound: set[str], abstract_constants: bool):
+        self.bound = bound
+        self.abstract_constants = abstract_constants
+        self.names: dict[str, str] = {}
+
+    @staticmethod
+    def bound_names(tree: ast.AST) -> set[str]:
+        bound, free = set(), set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+                bound.add(node.id)
+            elif isinstance(node, ast.arg):
+                bound.add(node.arg)
+            elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                bound.add(node.name)
+            elif isinstance(node, ast.alias) and node.asname is not None:
+                bound.add(node.asname)
+            elif isinstance(node, (ast.Global, ast.Nonlocal)):
+                free.update(node.names)
+        return bound - free
+
+    def rename(self, name: str) -> str:
+        if name not in self.bound:
+            return name
+        if name not in self.names:
+            self.names[name] = f'_{len(self.names)}'
+        return self.names[name]
+
+    def _strip_docstring(self, node: ast.AST):
+        body = node.body
+        if body and isinstance(body[0], ast.Expr) and isinstance(body[0].value, ast.Constant) \
+                and isinstance(body[0].value.value, str):
+            node.body = body[1:] or [ast.Pass()]
+
+    def _visit_scope(self, node: ast.AST) -> ast.AST:
+        self._strip_docstring(node)
+        if hasattr(node, 'name'):
+            node.name = self.rename(node.name)
+        return self.generic_visit(node)
+
+    visit_FunctionDef = _visit_scope
+    visit_AsyncFunctionDef = _visit_scope
+    visit_ClassDef = _visit_scope
+    visit_Module = _visit_scope
+
+    def visit_Name(self, node: ast.Name) -> ast.AST:
+        node.id = self.rename(node.id)
+        return node
+
+    def visit_arg(self, node: ast.arg) -> ast.AST:
+        node.arg = self.rename(node.arg)
+        return self.generic_visit(node)
+
+    def visit_keyword(self, node: ast.keyword) -> ast.AST:
+        # Keywords name the parameters they bind, `**kwargs` has none
+        if node.arg is not None:
+            node.arg = self.rename(node.arg)
+        return self.generic_visit(node)
+
+    def visit_Attribute(self, node: ast.Attribute) -> ast.AST:
+        # Attributes defined inside the solution, e.g. in a class body, are renamed along with their definition
+        node.attr = self.rename(node.attr)
+        return self.generic_visit(node)
+
+    def visit_alias(self, node: ast.alias) -> ast.AST:
+        if node.asname is not None:
+            node.asname = self.rename(node.asname)
+        return node
+
+    def visit_Constant(self, node: ast.Constant) -> ast.AST:
+        if self.abstract_constants:
+            node.value = type(node.value).__name__
+        return node
+
+
+def normalize(tree: ast.AST, abstract_constants: bool = False, rename: bool = True) -> ast.AST:
+    tree = copy.deepcopy(tree)
+    if isinstance(tree, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+        # The submission decorator is part of the live tree but not of the stored solution source
+        tree.decorator_list = []
+    bound = _Normalizer.bound_names(tree) if rename else set()
+    return _Normalizer(bound, abstract_constants).visit(tree)
+
+
+def fingerprint(tree: ast.AST, abstract_constants: bool = False, rename: bool = True) -> str:
+    """
+    Hex digest of the normalized tree, stable across processes unlike `hash()`.
+    Renaming catches copied solutions but also merges programs that behave differently,
+    anything that reuses results by the digest has to keep the names.
+    """
+    dump = ast.dump(normalize(tree, abstract_constants, rename))
+    return hashlib.blake2b(dump.encode(), digest_size=16).hexdigest()
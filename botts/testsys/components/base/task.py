@@ -5,7 +5,7 @@ from typing import Any, Callable
 from .units import CodeUnit
 from ..check.checker import Checker
 from ..check.executor import Executor
-from ..check.generator import generate, Generator
+from ..check.generator import generate, Generator, literal
 from ..check.validator import Validator
 from ..extract.jupyter import Locator
 
@@ -27,8 +27,18 @@ class Task:
     solution: Callable[[...], Any] | None
     statement: Statement = field(default_factory=Statement)
     time_limit: int = field(default=1)
+    # MiB on top of what the sandbox uses before the solution runs, None leaves it to INVOKER_MEMORY_LIMIT
+    memory_limit: int | None = field(default=256)
     executor: Executor | None = None
     extended_info: bool = False
+    cache_answers: bool = True
+    cache_verdicts: bool = True
+    seed: int | None = None
+
+    @property
+    def deterministic(self) -> bool:
+        # Without a seed only literal tests come out the same every time
+        return self.seed is not None or all(literal(test) for test in self.tests)
 
     def generate_tests(self, random: Random):
         return [generate(test, random) for test in self.tests]
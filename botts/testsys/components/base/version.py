@@ -0,0 +1,46 @@
+import hashlib
+import inspect
+import sys
+from types import FunctionType
+from typing import Any
+
+from common.testsys import wire
+from .task import Task
+from ..check.generator import Generator
+
+_versions: dict[int, str] = {}
+
+
+def _modules(value: Any, found: set[str], seen: set[int]):
+    if id(value) in seen:
+        return
+    seen.add(id(value))
+    if isinstance(value, FunctionType):
+        found.add(value.__module__)
+        for cell in value.__closure__ or ():
+            _modules(cell.cell_contents, found, seen)
+    elif isinstance(value, Generator):
+        found.add(type(value).__module__)
+        _modules(type(value).__call__, found, seen)
+        for item in vars(value).values():
+            _modules(item, found, seen)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            _modules(item, found, seen)
+
+
+def task_version(task: Task) -> str:
+    """Changes whenever the code that generates tests or reference answers of the task does"""
+    if id(task) not in _versions:
+        modules = set()
+        _modules([task.solution, task.executor, task.tests], modules, set())
+        digest = hashlib.blake2b(
+            f'{task.id_}:{task.seed}:{sys.version_info[:2]}:{wire.VERSION}'.encode(), digest_size=16
+        )
+        for name in sorted(modules):
+            try:
+                digest.update(inspect.getsource(sys.modules[name]).encode())
+            except (KeyError, OSError, TypeError):
+                digest.update(name.encode())
+        _versions[id(task)] = digest.hexdigest()
+    return _versions[id(task)]
@@ -12,9 +12,14 @@ class Result:
     cause: str | None
     invoker_id: str | None = field(default=None)
     invoker_port: str | None = field(default=None)
+    max_rss: int | None = field(default=None)
+    cpu_time: float | None = field(default=None)
 
 
 class Checker(ABC):
+    # Stateful checkers have side effects or depend on who submitted, their verdicts are never reused
+    stateful = False
+
     @abstractmethod
     def check(self, in_data: Any, out_data: Any, answer: Any, **kwargs) -> Result:
         pass
@@ -31,6 +36,10 @@ class _VerboseChecker(Checker):
     def __init__(self, wrapped: Checker):
         super().__init__()
         self.checker = wrapped
+
+    @property
+    def stateful(self) -> bool:
+        return self.checker.stateful
     
     def check(self, in_data: Any, out_data: Any, answer: Any, **kwargs) -> Result:
         result = self.checker.check(in_data, out_data, answer, **kwargs)
@@ -85,6 +94,10 @@ class SequenceOf(Checker):
         self.as_type = as_type
         self.sorted = sorted
 
+    @property
+    def stateful(self) -> bool:
+        return self.sub_checker.stateful
+
     @staticmethod
     def sort(values: Iterable[Any]) -> Iterable[Any]:
         return sorted(values, key=repr)
@@ -109,6 +122,10 @@ class DictOf(Checker):
         self.key_checker = key_checker
         self.value_checker = value_checker
 
+    @property
+    def stateful(self) -> bool:
+        return self.key_checker.stateful or self.value_checker.stateful
+
     def check(self, _: Any, out_data: Any, answer: dict, **__) -> Result:
         if not isinstance(out_data, dict):
             return Result(Verdict.IA, f"expected a dict, got '{out_data}'")
@@ -131,6 +148,10 @@ class EitherOf(Checker):
     def __init__(self, *sub_checkers: Checker):
         self.sub_checkers = sub_checkers
 
+    @property
+    def stateful(self) -> bool:
+        return any(sub_checker.stateful for sub_checker in self.sub_checkers)
+
     def check(self, in_data: Any, out_data: Any, answer: Any, **__) -> Result:
         causes = []
         for sub_checker in self.sub_checkers:
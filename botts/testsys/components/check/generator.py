@@ -15,6 +15,11 @@ class Generator(ABC):
     def __call__(self, random: Random, *args, **kwargs) -> Any:
         pass
 
+    @property
+    def literal(self) -> bool:
+        # Whether the generator ignores `random` and always produces the same value
+        return False
+
     def repeat(self, number: int, as_type: type = tuple) -> 'Generator':
         class RepeatingGenerator(Generator):
             def __call__(_, random: Random, *args, **kwargs) -> Any:
@@ -74,6 +79,10 @@ def delay(generator: type) -> Callable:
     return initialize
 
 
+def literal(gen_object: Generator | Any) -> bool:
+    return not isinstance(gen_object, Generator) or gen_object.literal
+
+
 def generate(gen_object: Generator | Any, random: Random) -> Any:
     if isinstance(gen_object, Generator):
         return gen_object(random)
@@ -119,6 +128,10 @@ class ArgList(Generator):
     def __init__(self, *sub_gens: Generator | Any):
         self.sub_gens = sub_gens
 
+    @property
+    def literal(self) -> bool:
+        return all(literal(sub_gen) for sub_gen in self.sub_gens)
+
     def __call__(self, random: Random) -> Any:
         return Arguments(
             tuple([generate(sub_gen, random) for sub_gen in self.sub_gens]),
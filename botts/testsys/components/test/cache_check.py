@@ -0,0 +1,85 @@
+import importlib
+import pkgutil
+import sys
+import tempfile
+from pathlib import Path
+from random import Random
+
+from peewee import SqliteDatabase
+
+from botts.db.cached_answer import CachedAnswer
+from .answer_cache import AnswerCache
+from .runner import Runner, resolved, safe_run
+from .verdict_cache import VerdictCache
+from ..base.task import Task
+
+TASK_PACKAGE = 'botts.testsys.config.tasks'
+
+
+def shipped_tasks() -> dict[str, Task]:
+    package = importlib.import_module(TASK_PACKAGE)
+    tasks = {}
+    for module_info in pkgutil.walk_packages(package.__path__, f'{TASK_PACKAGE}.'):
+        module = importlib.import_module(module_info.name)
+        for value in vars(module).values():
+            if isinstance(value, Task):
+                tasks[value.id_] = value
+    return tasks
+
+
+def check_cacheable(tasks: dict[str, Task]) -> bool:
+    """Verdicts are only reused for deterministic tasks, at least one of the shipped ones has to qualify"""
+    cacheable = 0
+    for task_id, task in sorted(tasks.items()):
+        ok = VerdictCache.cacheable(task)
+        cacheable += ok
+        print(f'{"cacheable" if ok else "         "} {task_id}{"" if task.deterministic else " (random tests)"}')
+    print(f'{cacheable} of {len(tasks)} tasks have cacheable verdicts')
+    return cacheable > 0
+
+
+def _restores_answers(task: Task, directory: Path) -> bool:
+    solution = Runner.reference(task)
+    tests = task.generate_tests(Random(task.seed))
+
+    def missing():
+        raise LookupError('answer was not persisted')
+
+    database = SqliteDatabase(directory / f'{task.id_}.db')
+    with database.bind_ctx([CachedAnswer]):
+        database.create_tables([CachedAnswer])
+        answers = [AnswerCache().answer(task, test, lambda: safe_run(solution, resolved(test))) for test in tests]
+        database.close()
+
+        database.connect()
+        try:
+            restored = [AnswerCache().answer(task, test, missing) for test in tests]
+        except LookupError:
+            return False
+        finally:
+            database.close()
+    return restored == answers
+
+
+def check_persistence(tasks: dict[str, Task]) -> bool:
+    """Reference answers of deterministic tasks have to come back from the database after a restart"""
+    eligible = {
+        task_id: task for task_id, task in sorted(tasks.items())
+        if task.deterministic and task.cache_answers and task.solution is not None
+    }
+    ok = len(eligible) > 0
+    with tempfile.TemporaryDirectory() as directory:
+        for task_id, task in eligible.items():
+            restored = _restores_answers(task, Path(directory))
+            ok = ok and restored
+            print(f'{"ok" if restored else "FAIL"} {task_id} answers restored after reopening')
+    return ok
+
+
+def check() -> bool:
+    tasks = shipped_tasks()
+    return check_cacheable(tasks) & check_persistence(tasks)
+
+
+if __name__ == '__main__':
+    sys.exit(0 if check() else 1)
@@ -1,23 +1,32 @@
+import asyncio
 from datetime import datetime
 from typing import Awaitable, Callable
 
 from botts.db.submission import Submission
 from .runner import Runner
 from ..base.task import Task, Statement
+from ..base.units import FnCodeUnit
 from ..check.checker import Result, Verdict
-from ..extract.jupyter import NotebookContainer
+from ..extract.jupyter import Locator, NotebookContainer
 
 
 class Event:
     ALL: dict[str, 'Event'] = {}
+    CONCURRENCY = 4
 
-    def __init__(self, name: str, start: datetime, deadline: datetime, tasks: list[Task], *, statement_prefix: Statement | None = None):
+    def __init__(
+            self, name: str, start: datetime, deadline: datetime, tasks: list[Task], *,
+            statement_prefix: Statement | None = None, concurrency: int = CONCURRENCY
+    ):
         self.name = name
         self.start = start
         self.deadline = deadline
         self.tasks = tasks
         self.id_ = name.lower().replace(' ', '-')
         self.statement_prefix = statement_prefix
+        self.concurrency = concurrency
+        for task in self.tasks:
+            Runner.prepare(task)
         Event.ALL[self.id_] = self
 
     @property
@@ -38,6 +47,20 @@ class Event:
             items = [self.statement_prefix.md] + items
         return separator.join(items)
 
+    @staticmethod
+    async def _grade(task: Task, solutions: dict[Locator, FnCodeUnit], submission: Submission) -> Result:
+        if task.locator not in solutions:
+            return Result(Verdict.MS, None)
+
+        runner = Runner(task)
+        solution = solutions[task.locator]
+        if message := task.validator.validate(solution):
+            result = Result(Verdict.VE, message)
+            runner.store(solution, submission, result)
+            return result
+
+        return await runner.run(submission, solution)
+
     async def run(
             self, container: NotebookContainer, submission: Submission,
             step_callback: Callable[[...], Awaitable], final_callback: Callable[[...], Awaitable]
@@ -46,24 +69,19 @@ class Event:
         try:
             collect_report = container.collect([task.locator for task in self.tasks])
             solutions = collect_report.data
+            semaphore = asyncio.Semaphore(self.concurrency)
 
-            for task in self.tasks:
-                runner = Runner(task)
-
-                if task.locator not in solutions:
-                    results[task.id_] = Result(Verdict.MS, None)
-                    await step_callback(results)
-                    continue
+            async def grade(task: Task) -> Result:
+                async with semaphore:
+                    return await Event._grade(task, solutions, submission)
 
-                solution = solutions[task.locator]
-                if message := task.validator.validate(solution):
-                    result = Result(Verdict.VE, message)
-                    results[task.id_] = result
-                    runner.store(solution, submission, result)
+            pending = [asyncio.create_task(grade(task)) for task in self.tasks]
+            try:
+                for task, grading in zip(self.tasks, pending):
+                    results[task.id_] = await grading
                     await step_callback(results)
-                    continue
-
-                results[task.id_] = Runner(task).run(submission, solution)
-                await step_callback(results)
+            finally:
+                for grading in pending:
+                    grading.cancel()
         finally:
             await final_callback(results)
@@ -15,17 +15,17 @@ class VerdictError(Exception):
 class InvokerBase(ABC):
     @staticmethod
     def _handle_verdict_error(fn):
-        def wrapped(*args, **kwargs):
+        async def wrapped(*args, **kwargs):
             try:
-                return fn(*args, **kwargs)
+                return await fn(*args, **kwargs)
             except VerdictError as e:
                 return TestingResult(e.verdict, e.message, None)
 
         return wrapped
 
     @abstractmethod
-    def invoke(self, source: str | CodeUnit, args: Arguments, time_limit: int | float,
-               executor: str | None) -> TestingResult:
+    async def invoke(self, source: str | CodeUnit, args: Arguments, time_limit: int | float,
+                     executor: str | None) -> TestingResult:
         pass
 
 
@@ -44,8 +44,8 @@ class ExecInvoker(InvokerBase):
             raise VerdictError(on_fail, e.text)
 
     @InvokerBase._handle_verdict_error
-    def invoke(self, source: str | CodeUnit, args: Arguments, time_limit: int | float,
-               executor: str | None) -> TestingResult:
+    async def invoke(self, source: str | CodeUnit, args: Arguments, time_limit: int | float,
+                     executor: str | None) -> TestingResult:
         fn_name = ExecInvoker._extract_function_name(source, on_fail=Verdict.RE)
         if executor is not None:
             ex_name = ExecInvoker._extract_function_name(executor, on_fail=Verdict.CF)
@@ -1,21 +1,32 @@
+import asyncio
+import itertools
 import logging
-import pickle
+import time
+from dataclasses import dataclass
 from enum import Enum
-from queue import Queue
-from socket import AF_INET, SOCK_STREAM, socket
-from typing import Any
+from typing import Any, AsyncIterator
 
-import invoker.interface
-from botts.bot.config.local import report_fail
+from common.testsys import wire
+from common.testsys.runner import wall_limit
+from botts.bot.config.local import INVOKER_CONFIG, report_fail
 from botts.testsys.components.base.units import CodeUnit
 from botts.testsys.components.check.checker import Verdict
 from botts.testsys.components.check.generator import Arguments
 from botts.testsys.components.test.invoker_base import InvokerBase, TestingResult
+from botts.testsys.components.test.invoker_registry import Endpoint, InvokerRegistry, from_config
 
 
 class Status(Enum):
     FREE = 0
     BUSY = 1
+    DRAINING = 2
+
+
+@dataclass
+class _Breaker:
+    failures: int = 0
+    opened: float | None = None
+    restarts: int = 0
 
 
 class FailedContainerException(Exception):
@@ -26,89 +37,507 @@ class FailedContainerException(Exception):
 
 class SocketWrapper(InvokerBase):
     HOST = '127.0.0.1'
-    CHUNK_SIZE = 1024
     INVOKER_TIMEOUT = 30
+    # On top of the wall clock limit of a test: worker warm-up, fixture loading and the transfer of the result
+    RESPONSE_GRACE = 5
+    READ_LIMIT = 1 << 20
 
-    def __init__(self, port: int, id_: str, owner: 'InvokerPool'):
+    def __init__(self, port: int, id_: str, owner: 'InvokerPool', slot: int = 0):
         self.port = port
+        self.slot = slot
         self.id_ = id_
         self.owner = owner
-        self.socket = socket(AF_INET, SOCK_STREAM)
-        self.socket.settimeout(SocketWrapper.INVOKER_TIMEOUT)
-        self.connected = False
-
-    def __enter__(self):
-        self.socket.connect((SocketWrapper.HOST, self.port))
-        logging.getLogger('socket-wrapper').info(f'Connected on port {self.port}')
-        self.connected = True
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        self.socket.close()
-        logging.getLogger('socket-wrapper').info(f'Released port {self.port}')
-        self.connected = False
-        self.owner.release(self.port)
-
-    def send(self, value: Any):
-        value_data = pickle.dumps(value)
+        self.reader: asyncio.StreamReader | None = None
+        self.writer: asyncio.StreamWriter | None = None
+        self.listener: asyncio.Task | None = None
+        self.responses: dict[int, asyncio.Queue] = {}
+        self.timeouts: dict[int, float] = {}
+        self.request_ids = itertools.count(1)
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.logger = logging.getLogger('socket-wrapper')
+
+    @property
+    def connected(self) -> bool:
+        return self.writer is not None and not self.listener.done()
+
+    async def connect(self):
+        if self.connected:
+            return
+        await self.disconnect()
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(SocketWrapper.HOST, self.port, limit=SocketWrapper.READ_LIMIT),
+            SocketWrapper.INVOKER_TIMEOUT
+        )
+        self.listener = asyncio.create_task(self._listen())
+        self.logger.info(f'Connected on port {self.port}')
+
+    async def disconnect(self):
+        if self.writer is None:
+            return
+        self.listener.cancel()
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except OSError:
+            pass
+        self.reader, self.writer, self.listener = None, None, None
+        for queue in self.responses.values():
+            queue.put_nowait(ConnectionResetError('connection closed'))
+        self.responses.clear()
+        self.timeouts.clear()
+        self.logger.info(f'Disconnected from port {self.port}')
+
+    async def _listen(self):
+        try:
+            while True:
+                size = wire.unpack_header(await self.reader.readexactly(wire.HEADER.size))
+                frame = wire.loads(await self.reader.readexactly(size))
+                self.bytes_in += wire.HEADER.size + size
+                if (error := wire.check(frame, wire.RESPONSE)) is not None:
+                    raise wire.WireError(f'malformed response, {error}')
+                queue = self.responses.get(frame.get('id'))
+                if queue is not None:
+                    queue.put_nowait(frame)
+        except (asyncio.IncompleteReadError, ConnectionError, wire.WireError) as e:
+            self.logger.warning(f'Connection on port {self.port} lost: {e}')
+            for queue in self.responses.values():
+                queue.put_nowait(ConnectionResetError(str(e)))
+
+    async def __aenter__(self):
+        try:
+            await self.connect()
+        except BaseException as e:
+            if isinstance(e, OSError):
+                self.owner.report(self.id_, False)
+            self.owner.release((self.id_, self.slot))
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None and not issubclass(exc_type, asyncio.CancelledError):
+            await self.disconnect()
+        if exc_type is not None and issubclass(exc_type, OSError):
+            self.owner.report(self.id_, False)
+        self.logger.info(f'Released port {self.port}, slot {self.slot}')
+        self.owner.release((self.id_, self.slot))
+
+    async def _send_frame(self, package: bytes | bytearray):
+        if not self.connected:
+            raise ConnectionResetError('Can not operate on closed socket')
+        self.writer.write(package)
+        self.bytes_out += len(package)
+        await self.writer.drain()
+
+    @staticmethod
+    def response_timeout(time_limit: int | float) -> float:
+        return wall_limit(time_limit) + SocketWrapper.RESPONSE_GRACE
+
+    async def send(self, value: dict[str, Any]) -> int:
+        request_id = next(self.request_ids)
+        self.timeouts[request_id] = SocketWrapper.response_timeout(value.get('time_limit', 1))
+        package = wire.pack(value | {'id': request_id})
+        try:
+            self.responses[request_id] = asyncio.Queue()
+            await self._send_frame(package)
+        except OSError:
+            self.logger.warning(f'Connection on port {self.port} is broken, reconnecting')
+            await self.disconnect()
+            await self.connect()
+            self.responses[request_id] = asyncio.Queue()
+            await self._send_frame(package)
+        return request_id
+
+    async def cancel(self, request_id: int):
+        self.responses.pop(request_id, None)
+        self.timeouts.pop(request_id, None)
         if not self.connected:
-            raise ValueError('Can not operate on closed socket')
-        self.socket.send(len(value_data).to_bytes(8))
-        self.socket.send(value_data)
+            return
+        try:
+            await self._send_frame(wire.pack({'id': request_id, 'cancel': True}))
+        except OSError:
+            await self.disconnect()
 
-    def receive(self) -> Any:
+    async def receive(self, request_id: int, timeout: float | None = None) -> Any:
+        queue = self.responses.get(request_id)
+        if queue is None:
+            return {
+                'verdict': 'CF',
+                'message': 'lost connection to invoker'
+            }
+        if timeout is None:
+            timeout = self.timeouts.get(request_id, SocketWrapper.INVOKER_TIMEOUT)
         try:
-            data = bytes()
-            size = int.from_bytes(self.socket.recv(8))
-            while len(data) < size:
-                data += self.socket.recv(SocketWrapper.CHUNK_SIZE)
-            return pickle.loads(data[:size])
-        except TimeoutError as e:
-            cnt = self.owner.docker_client.containers.get_by_id(self.id_)
-            report_fail(
+            frame = await asyncio.wait_for(queue.get(), timeout)
+        except TimeoutError:
+            await self.disconnect()
+            self.owner.report(self.id_, False)
+            logs = await asyncio.to_thread(self.owner.registry.logs, self.id_)
+            await report_fail(
                 f'```Invoker {self.id_}:{self.port} not responding:\n'
-                f'{cnt.logs().decode("utf-8")}```'
+                f'{logs.decode("utf-8")}```'
             )
             return {
                 'verdict': 'CF',
-                'message': f'invoker failed to respond in {SocketWrapper.INVOKER_TIMEOUT}s'
+                'message': f'invoker failed to respond in {timeout:g}s'
             }
+        if isinstance(frame, ConnectionError):
+            return {
+                'verdict': 'CF',
+                'message': f'lost connection to invoker: {frame}'
+            }
+        self.owner.report(self.id_, True)
+        if frame.get('done', True):
+            self.responses.pop(request_id, None)
+            self.timeouts.pop(request_id, None)
+        return frame
+
+    async def ping(self, timeout: float) -> dict[str, Any] | None:
+        request_id = None
+        try:
+            async with asyncio.timeout(timeout):
+                await self.connect()
+                request_id = await self.send({'ping': True})
+                frame = await self.responses[request_id].get()
+        except (OSError, TimeoutError):
+            await self.disconnect()
+            return None
+        finally:
+            self.responses.pop(request_id, None)
+            self.timeouts.pop(request_id, None)
+        if isinstance(frame, ConnectionError):
+            return None
+        return frame.get('pong', {})
+
+    async def receive_batch(
+            self, request_id: int, count: int, timeout: float | None = None
+    ) -> AsyncIterator[tuple[int, Any]]:
+        finished = count == 0
+        try:
+            for i in range(count):
+                result = await self.receive(request_id, timeout)
+                finished = i == count - 1 or 'error' in result or result['verdict'] != 'OK'
+                yield i, result
+                if finished:
+                    return
+        finally:
+            if not finished:
+                await self.cancel(request_id)
 
-    def invoke(self, source: str | CodeUnit, args: Arguments, time_limit: int | float,
-               executor: str | None) -> TestingResult:
-        self.send({
+    async def invoke(self, source: str | CodeUnit, args: Arguments, time_limit: int | float,
+                     executor: str | None) -> TestingResult:
+        request_id = await self.send({
             'executor': executor,
-            'source': source,
-            'args': args,
+            'source': source if isinstance(source, str) else source.source,
+            'args': args.args,
             'time_limit': time_limit
         })
-        result = self.receive()
+        result = await self.receive(request_id)
         message = result.get('message', result.get('error', None))
-        return TestingResult(Verdict[result['verdict']], message, result.get('value', None))
+        return TestingResult(Verdict[result.get('verdict', 'CF')], message, result.get('value', None))
 
 
 class InvokerPool:
-    def __init__(self):
-        self.docker_client = invoker.interface.Client()
-        self.config = self.docker_client.containers.port_mapping
-
-        self.status: dict[int, Status] = {}
-        self.queue = Queue()
-        for port in self.config:
-            self.status[port] = Status.FREE
-            self.queue.put(port)
-
-    def acquire(self) -> SocketWrapper:
-        port = self.queue.get()
-        self.status[port] = Status.BUSY
-        return SocketWrapper(port, self.config[port].id, self)
-
-    def release(self, port: int):
-        container = self.config[port]
-        if container.status != 'running':
-            logging.getLogger('invoker-pool').warning(f'Container on port {port} failed')
-            raise FailedContainerException(container.logs())
-        self.status[port] = Status.FREE
-        self.queue.put(port)
+    RECONCILE_INTERVAL = 10
+    SCALE_UP_WAIT = 5
+    SCALE_DOWN_IDLE = 300
+    SCALE_COOLDOWN = 60
+    MIN_INVOKERS = INVOKER_CONFIG.get('min_invokers', 1)
+    MAX_INVOKERS = INVOKER_CONFIG.get('max_invokers', 0)
+    PROBE_INTERVAL = 5
+    PROBE_TIMEOUT = 5
+    FAILURE_THRESHOLD = 3
+    QUARANTINE_RESTART = 30
+    MAX_RESTARTS = 2
+
+    def __init__(self, registry: InvokerRegistry | None = None):
+        self.registry = registry or from_config(INVOKER_CONFIG)
+        self.endpoints: dict[int, Endpoint] = {}
+
+        self.status: dict[tuple[str, int], Status] = {}
+        self.wrappers: dict[tuple[str, int], SocketWrapper] = {}
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.queue: asyncio.Queue[tuple[str, int]] = asyncio.Queue()
+        self.maintainer: asyncio.Task | None = None
+        self.prober: asyncio.Task | None = None
+        self.closing: set[asyncio.Task] = set()
+
+        self.breakers: dict[str, _Breaker] = {}
+        self.failed: set[str] = set()
+        self.lost: list[str] = []
+        self.retiring: set[str] = set()
+        self.restarting: dict[str, float] = {}
+        self.waiting: list[float] = []
+        self.waits: list[float] = []
+        self.last_busy = time.monotonic()
+        self.last_scale = 0.
+        self.logger = logging.getLogger('invoker-pool')
+
+    def _bind(self):
+        loop = asyncio.get_running_loop()
+        if self.loop is loop:
+            return
+        self.loop = loop
+        self.status.clear()
+        self.wrappers.clear()
+        self.queue = asyncio.Queue()
+        for endpoint in self.endpoints.values():
+            self._expand(endpoint)
+        self.maintainer = loop.create_task(self._maintain())
+        self.prober = loop.create_task(self._probe())
+
+    def _expand(self, endpoint: Endpoint):
+        for slot in range(endpoint.capacity):
+            key = endpoint.id_, slot
+            status = self.status.get(key)
+            if status is None:
+                self.status[key] = Status.FREE
+                self.queue.put_nowait(key)
+            elif status == Status.DRAINING:
+                self.status[key] = Status.BUSY
+
+    def _drain(self, id_: str, capacity: int):
+        dropped = set()
+        for key, status in list(self.status.items()):
+            if key[0] != id_ or key[1] < capacity:
+                continue
+            if status == Status.FREE:
+                del self.status[key]
+                self._drop(key)
+                dropped.add(key)
+            else:
+                self.status[key] = Status.DRAINING
+        if not dropped:
+            return
+        kept = []
+        while not self.queue.empty():
+            if (key := self.queue.get_nowait()) not in dropped:
+                kept.append(key)
+        for key in kept:
+            self.queue.put_nowait(key)
+
+    def _drop(self, key: tuple[str, int]):
+        wrapper = self.wrappers.pop(key, None)
+        if wrapper is None:
+            return
+        task = self.loop.create_task(wrapper.disconnect())
+        self.closing.add(task)
+        task.add_done_callback(self.closing.discard)
+
+    def reconcile(self, endpoints: dict[int, Endpoint]):
+        current = {endpoint.id_: endpoint for endpoint in endpoints.values()}
+        for endpoint in self.endpoints.values():
+            if endpoint.id_ in current:
+                self._drain(endpoint.id_, current[endpoint.id_].capacity)
+                continue
+            if endpoint.id_ in self.retiring:
+                self.logger.info(f'Invoker {endpoint.id_} on port {endpoint.port} retired')
+            elif self.restarting.get(endpoint.id_, 0) > time.monotonic():
+                self.logger.info(f'Invoker {endpoint.id_} on port {endpoint.port} is restarting')
+            else:
+                self.logger.warning(f'Invoker {endpoint.id_} on port {endpoint.port} disappeared')
+                self.failed.add(endpoint.id_)
+                self.lost.append(endpoint.id_)
+            self._drain(endpoint.id_, 0)
+            self._drop((endpoint.id_, -1))
+            self.breakers.pop(endpoint.id_, None)
+        for id_, endpoint in current.items():
+            if id_ not in {known.id_ for known in self.endpoints.values()}:
+                self.logger.info(f'Invoker {id_} discovered on port {endpoint.port}')
+            if not self._quarantined(id_):
+                self._expand(endpoint)
+        self.endpoints = endpoints
+        self.retiring &= current.keys()
+        for id_ in list(self.restarting):
+            if id_ in current or self.restarting[id_] <= time.monotonic():
+                del self.restarting[id_]
+
+    def _quarantined(self, id_: str) -> bool:
+        breaker = self.breakers.get(id_)
+        return breaker is not None and breaker.opened is not None
+
+    def report(self, id_: str, healthy: bool):
+        if not any(endpoint.id_ == id_ for endpoint in self.endpoints.values()):
+            return
+        breaker = self.breakers.setdefault(id_, _Breaker())
+        if healthy:
+            breaker.failures = 0
+            if breaker.opened is None:
+                return
+            breaker.opened, breaker.restarts = None, 0
+            endpoint = next((e for e in self.endpoints.values() if e.id_ == id_), None)
+            if endpoint is not None:
+                self.logger.info(f'Invoker {id_} on port {endpoint.port} recovered')
+                self._expand(endpoint)
+            return
+        breaker.failures += 1
+        if breaker.opened is None and breaker.failures >= InvokerPool.FAILURE_THRESHOLD:
+            self.logger.warning(f'Invoker {id_} failed {breaker.failures} times in a row, quarantined')
+            breaker.opened = time.monotonic()
+            self._drain(id_, 0)
+
+    async def _probe(self):
+        while True:
+            await asyncio.sleep(InvokerPool.PROBE_INTERVAL)
+            endpoints = list(self.endpoints.values())
+            pongs = await asyncio.gather(*(
+                self._occupy((endpoint.id_, -1)).ping(InvokerPool.PROBE_TIMEOUT)
+                for endpoint in endpoints
+            ))
+            for endpoint, pong in zip(endpoints, pongs):
+                self.report(endpoint.id_, pong is not None)
+            try:
+                await self._recover()
+            except Exception as e:
+                self.logger.warning(f'Invoker recovery failed: {e}')
+
+    @property
+    def managed(self) -> bool:
+        # Without autoscaling the fleet belongs to the operator, e.g. `make invokers`, and is never resized here
+        return self.registry.scalable and InvokerPool.MAX_INVOKERS > 0
+
+    async def _recover(self):
+        if not self.registry.scalable:
+            return
+        while self.lost:
+            id_ = self.lost.pop()
+            live = [endpoint for endpoint in self.endpoints.values() if endpoint.id_ not in self.retiring]
+            if not self.managed or len(live) >= InvokerPool.MIN_INVOKERS:
+                self.logger.info(f'Not replacing lost invoker {id_}, {len(live)} still running')
+                continue
+            self.logger.info(f'Replacing lost invoker {id_}')
+            try:
+                await asyncio.to_thread(self.registry.stop, id_)
+            except Exception as e:
+                self.logger.warning(f'Could not clean up invoker {id_}: {e}')
+            await asyncio.to_thread(self.registry.start, 1)
+
+        now = time.monotonic()
+        for id_, breaker in list(self.breakers.items()):
+            if breaker.opened is None or now - breaker.opened < InvokerPool.QUARANTINE_RESTART:
+                continue
+            if id_ in self.retiring:
+                continue
+            if breaker.restarts < InvokerPool.MAX_RESTARTS:
+                breaker.restarts += 1
+                breaker.opened = now
+                self.logger.warning(f'Restarting quarantined invoker {id_}, attempt {breaker.restarts}')
+                self.restarting[id_] = now + InvokerPool.QUARANTINE_RESTART
+                await asyncio.to_thread(self.registry.restart, id_)
+                continue
+            if not self.managed:
+                continue
+            self.logger.warning(f'Invoker {id_} did not recover after {breaker.restarts} restarts, replacing')
+            self.retiring.add(id_)
+            await asyncio.to_thread(self.registry.stop, id_)
+            await asyncio.to_thread(self.registry.start, 1)
+
+    async def start(self):
+        self._bind()
+
+    async def stop(self):
+        for task in (self.maintainer, self.prober):
+            if task is not None:
+                task.cancel()
+        for key in list(self.wrappers):
+            self._drop(key)
+        await asyncio.gather(*self.closing, return_exceptions=True)
+        await asyncio.to_thread(self.registry.close)
+        self.endpoints = {}
+        self.breakers.clear()
+        self.loop = None
+
+    async def _maintain(self):
+        while True:
+            try:
+                self.reconcile(await asyncio.to_thread(self.registry.discover))
+                await self._autoscale()
+            except Exception as e:
+                self.logger.warning(f'Pool maintenance failed: {e}')
+            await asyncio.sleep(InvokerPool.RECONCILE_INTERVAL)
+
+    async def _autoscale(self):
+        now = time.monotonic()
+        waits = self.waits + [now - started for started in self.waiting]
+        self.waits = []
+        if not self.registry.scalable or InvokerPool.MAX_INVOKERS <= 0:
+            return
+        if now - self.last_scale < InvokerPool.SCALE_COOLDOWN:
+            return
+
+        live = [endpoint for endpoint in self.endpoints.values() if endpoint.id_ not in self.retiring]
+        if self.waiting and max(waits) >= InvokerPool.SCALE_UP_WAIT and len(live) < InvokerPool.MAX_INVOKERS:
+            capacity = max((endpoint.capacity for endpoint in live), default=1)
+            count = min(-(-len(self.waiting) // capacity), InvokerPool.MAX_INVOKERS - len(live))
+            self.logger.info(
+                f'{len(self.waiting)} waiting for up to {max(waits):.1f}s, starting {count} invoker(s)'
+            )
+            self.last_scale = now
+            await asyncio.to_thread(self.registry.start, count)
+            return
+
+        busy = any(status != Status.FREE for status in self.status.values())
+        if busy or self.waiting or now - self.last_busy < InvokerPool.SCALE_DOWN_IDLE:
+            return
+        if len(live) <= InvokerPool.MIN_INVOKERS:
+            return
+        endpoint = min(live, key=lambda e: e.capacity)
+        self.logger.info(f'Pool idle for {now - self.last_busy:.0f}s, retiring invoker {endpoint.id_}')
+        self.last_scale = now
+        self.retiring.add(endpoint.id_)
+        self._drain(endpoint.id_, 0)
+        await asyncio.to_thread(self.registry.stop, endpoint.id_)
+
+    def _occupy(self, key: tuple[str, int]) -> SocketWrapper:
+        id_, slot = key
+        # Slot -1 is the health probe connection, it never enters the queue
+        if slot >= 0:
+            self.status[key] = Status.BUSY
+            self.last_busy = time.monotonic()
+        port = next(endpoint.port for endpoint in self.endpoints.values() if endpoint.id_ == id_)
+        if key in self.wrappers and self.wrappers[key].port != port:
+            self._drop(key)
+        if key not in self.wrappers:
+            self.wrappers[key] = SocketWrapper(port, id_, self, slot)
+        return self.wrappers[key]
+
+    async def acquire(self) -> SocketWrapper:
+        self._bind()
+        started = time.monotonic()
+        self.waiting.append(started)
+        try:
+            key = await self.queue.get()
+        finally:
+            self.waiting.remove(started)
+        self.waits.append(time.monotonic() - started)
+        return self._occupy(key)
+
+    def try_acquire(self) -> SocketWrapper | None:
+        self._bind()
+        try:
+            return self._occupy(self.queue.get_nowait())
+        except asyncio.QueueEmpty:
+            return None
+
+    def release(self, key: tuple[str, int]):
+        status = self.status.get(key)
+        self.last_busy = time.monotonic()
+        if status == Status.BUSY:
+            self.status[key] = Status.FREE
+            self.queue.put_nowait(key)
+            return
+        if status != Status.DRAINING:
+            return
+
+        id_, _ = key
+        del self.status[key]
+        self._drop(key)
+        if id_ not in self.failed:
+            return
+        if not any(other[0] == id_ for other in self.status):
+            self.failed.discard(id_)
+        self.logger.warning(f'Invoker {id_} failed')
+        raise FailedContainerException(self.registry.logs(id_))
 
 
 INVOKER_POOL = InvokerPool()
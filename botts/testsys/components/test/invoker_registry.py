@@ -0,0 +1,232 @@
+import os
+import pwd
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    import invoker.interface
+
+
+@dataclass(frozen=True)
+class Endpoint:
+    port: int
+    id_: str
+    capacity: int = 1
+
+
+class InvokerRegistry(ABC):
+    scalable = False
+
+    @abstractmethod
+    def discover(self) -> dict[int, Endpoint]:
+        pass
+
+    @abstractmethod
+    def logs(self, id_: str) -> bytes:
+        pass
+
+    def start(self, count: int):
+        raise NotImplementedError(f'{type(self).__name__} can not start invokers')
+
+    def stop(self, id_: str):
+        raise NotImplementedError(f'{type(self).__name__} can not stop invokers')
+
+    def restart(self, id_: str):
+        raise NotImplementedError(f'{type(self).__name__} can not restart invokers')
+
+    def close(self):
+        pass
+
+
+class DockerRegistry(InvokerRegistry):
+    scalable = True
+
+    def __init__(self, base_url: str | None = None, cpus: float = 1):
+        self.base_url = base_url
+        self.cpus = cpus
+        self._client: 'invoker.interface.Client | None' = None
+
+    @property
+    def client(self) -> 'invoker.interface.Client':
+        # Importing the docker SDK and resolving the daemon endpoint is slow, defer it to the first discovery
+        if self._client is None:
+            import invoker.interface
+            self._client = invoker.interface.Client(self.base_url, self.cpus)
+        return self._client
+
+    def discover(self) -> dict[int, Endpoint]:
+        containers = self.client.containers
+        return {
+            port: Endpoint(port, cnt.id, containers.capacity[port])
+            for port, cnt in containers.port_mapping.items()
+        }
+
+    def logs(self, id_: str) -> bytes:
+        cnt = self.client.containers.get_by_id(id_)
+        return b'' if cnt is None else cnt.logs()
+
+    def start(self, count: int):
+        self.client.scale_up(count)
+
+    def stop(self, id_: str):
+        self.client.retire(id_)
+
+    def restart(self, id_: str):
+        self.client.restart(id_)
+
+
+class StaticRegistry(InvokerRegistry):
+    def __init__(self, endpoints: list[Endpoint]):
+        self.endpoints = {endpoint.port: endpoint for endpoint in endpoints}
+
+    def discover(self) -> dict[int, Endpoint]:
+        return dict(self.endpoints)
+
+    def logs(self, id_: str) -> bytes:
+        return b''
+
+
+class LocalRegistry(InvokerRegistry):
+    scalable = True
+    ROOT = Path(__file__).parents[4]
+    HOST = '127.0.0.1'
+    READY_TIMEOUT = 10
+    LOG_TAIL = 1 << 16
+
+    # Only these reach the invokers, the bot's environment holds its tokens
+    ENVIRONMENT = ('PATH', 'LANG', 'LOGLEVEL')
+
+    def __init__(
+            self, count: int, sandboxes: int | None = None, runner: str = 'invoker.runners.mp',
+            user: str | None = None
+    ):
+        self.count = count
+        self.sandboxes = sandboxes or max(1, len(os.sched_getaffinity(0)) // count)
+        self.runner = runner
+        self.user = user
+        self.processes: dict[int, subprocess.Popen] = {}
+        self.started = False
+        self.workdir: Path | None = None
+
+    def _prepare_workdir(self) -> Path:
+        # Invokers never run from the repository root, where relative paths would reach config.toml and data.db
+        if self.workdir is None:
+            self.workdir = Path(tempfile.mkdtemp(prefix='invokers-'))
+            (self.workdir / 'logs').mkdir()
+            if self.user is not None:
+                for path in (self.workdir, self.workdir / 'logs'):
+                    shutil.chown(path, self.user)
+        return self.workdir
+
+    @staticmethod
+    def _id(port: int) -> str:
+        return f'local:{port}'
+
+    @staticmethod
+    def _port(id_: str) -> int:
+        return int(id_.removeprefix('local:'))
+
+    @staticmethod
+    def _free_port() -> int:
+        with socket.socket() as sock:
+            sock.bind((LocalRegistry.HOST, 0))
+            return sock.getsockname()[1]
+
+    def _log_path(self, port: int) -> Path:
+        return LocalRegistry.ROOT / 'logs' / f'invoker-{port}.log'
+
+    def _spawn(self, port: int):
+        workdir = self._prepare_workdir()
+        env = {name: os.environ[name] for name in LocalRegistry.ENVIRONMENT if name in os.environ} | {
+            'HOME': str(workdir),
+            'PYTHONPATH': str(LocalRegistry.ROOT),
+            'INVOKER_ACCEPT': LocalRegistry.HOST,
+            'INVOKER_SANDBOXES': str(self.sandboxes)
+        }
+        credentials = {}
+        if self.user is not None:
+            credentials = {'user': self.user, 'group': pwd.getpwnam(self.user).pw_gid, 'extra_groups': []}
+        self._log_path(port).parent.mkdir(exist_ok=True)
+        with open(self._log_path(port), 'ab') as log:
+            self.processes[port] = subprocess.Popen(
+                [sys.executable, '-m', self.runner, str(port)],
+                cwd=workdir, env=env,
+                stdout=log, stderr=subprocess.STDOUT, start_new_session=True,
+                **credentials
+            )
+
+        deadline = time.monotonic() + LocalRegistry.READY_TIMEOUT
+        while self.processes[port].poll() is None and time.monotonic() < deadline:
+            try:
+                socket.create_connection((LocalRegistry.HOST, port), timeout=0.1).close()
+                return
+            except OSError:
+                time.sleep(0.1)
+
+    def discover(self) -> dict[int, Endpoint]:
+        if not self.started:
+            self.started = True
+            self.start(self.count)
+        return {
+            port: Endpoint(port, LocalRegistry._id(port), self.sandboxes)
+            for port, process in self.processes.items()
+            if process.poll() is None
+        }
+
+    def logs(self, id_: str) -> bytes:
+        try:
+            with open(self._log_path(LocalRegistry._port(id_)), 'rb') as log:
+                log.seek(max(0, log.seek(0, os.SEEK_END) - LocalRegistry.LOG_TAIL))
+                return log.read()
+        except OSError:
+            return b''
+
+    def start(self, count: int):
+        for _ in range(count):
+            self._spawn(LocalRegistry._free_port())
+
+    def stop(self, id_: str):
+        process = self.processes.pop(LocalRegistry._port(id_), None)
+        if process is None:
+            return
+        process.kill()
+        process.wait()
+
+    def restart(self, id_: str):
+        self.stop(id_)
+        self._spawn(LocalRegistry._port(id_))
+
+    def close(self):
+        for port in list(self.processes):
+            self.stop(LocalRegistry._id(port))
+        self.started = False
+        if self.workdir is not None:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+            self.workdir = None
+
+
+def from_config(config: dict[str, Any]) -> InvokerRegistry:
+    backend = config.get('backend', 'docker')
+    if backend == 'docker':
+        return DockerRegistry(config.get('docker_host'), config.get('invoker_cpus', 1))
+    if backend == 'local':
+        if config.get('local_user') is None and not config.get('unsafe_local', False):
+            raise ValueError(
+                'local invokers run student code on this host, set \'local_user\' to a dedicated account '
+                'or acknowledge the risk with \'unsafe_local = true\''
+            )
+        return LocalRegistry(config.get('local_invokers', 1), config.get('sandboxes'), user=config.get('local_user'))
+    if backend == 'static':
+        return StaticRegistry([
+            Endpoint(port, f'static:{port}', config.get('sandboxes', 1))
+            for port in config.get('ports', [])
+        ])
+    raise ValueError(f'unknown invoker backend \'{backend}\'')
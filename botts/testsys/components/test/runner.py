@@ -1,19 +1,33 @@
 import ast
+import asyncio
 import copy
 import inspect
+import time
+from contextlib import aclosing
 from random import Random
-from typing import Awaitable, Callable
+from typing import Any, Awaitable, Callable
 
 from botts.bot.config.local import report_fail
 from botts.db.run import Run
+from botts.db.run_metrics import RunMetrics, pack_tests
 from botts.db.submission import Submission
-from .invoker_pool import FailedContainerException, INVOKER_POOL
+from common.testsys import fixtures, wire
+from .answer_cache import ANSWER_CACHE
+from .invoker_pool import FailedContainerException, INVOKER_POOL, SocketWrapper
+from .scheduler import GRADING_SCHEDULER, Priority
+from .suite import SUITES, Suite
+from .verdict_cache import VERDICT_CACHE
+from ..base.fingerprint import fingerprint
 from ..base.task import Task
 from ..base.units import FnCodeUnit
 from ..check.checker import Result, Verdict
 from ..check.generator import Arguments
 
 
+def resolved(test: Arguments) -> Arguments:
+    return Arguments(fixtures.resolve(test.args), test.kwargs)
+
+
 def safe_run(fn: Callable, input_: Arguments):
     try:
         args = copy.deepcopy(input_.args)
@@ -24,85 +38,213 @@ def safe_run(fn: Callable, input_: Arguments):
     return result
 
 
+class _FanOut:
+    def __init__(self, tests: int, shards: int):
+        self.shards = [list(range(shard, tests, shards)) for shard in range(shards)]
+        self.progress = [0 for _ in range(shards)]
+        self.tasks: list[asyncio.Task] = []
+        self.failure: int | None = None
+        self.outcomes: dict[int, Result] = {}
+        self.usage: dict[int, dict[str, Any]] = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def needs(self, i: int) -> bool:
+        return self.failure is None or i < self.failure
+
+    def pending(self, shard: int) -> int:
+        indices = self.shards[shard]
+        return indices[min(self.progress[shard], len(indices) - 1)]
+
+    def advance(self, shard: int, progress: int):
+        self.progress[shard] = progress
+
+    def fail(self, i: int, outcome: Result):
+        if not self.needs(i):
+            return
+        self.failure = i
+        self.outcomes[i] = outcome
+        current = asyncio.current_task()
+        for shard, task in enumerate(self.tasks):
+            if task is current or task.done() or self.progress[shard] >= len(self.shards[shard]):
+                continue
+            if not self.needs(self.pending(shard)):
+                task.cancel()
+
+
 class Runner:
+    MAX_SHARDS = 8
+    USAGE = ('cpu_time', 'wall_time', 'max_rss')
+
     def __init__(self, task: Task):
         self.task = task
         self.solution = self.task.solution
+        self.metrics: dict[str, Any] | None = None
+        self.suite: Suite | None = None
+
+    @staticmethod
+    def reference(task: Task) -> Callable | None:
+        solution = task.solution
+        if solution is not None and task.executor is not None:
+            solution = task.executor(solution)
+        return solution
+
+    @staticmethod
+    def prepare(task: Task) -> Suite | None:
+        solution = Runner.reference(task)
+        return SUITES.get(task, None if solution is None else lambda test: safe_run(solution, resolved(test)))
 
     @staticmethod
-    def solution_hash(source: ast.AST):
-        return hash(ast.dump(source))
+    def solution_hash(source: ast.AST) -> str:
+        return fingerprint(source)
+
+    def _evaluate(
+            self, i: int, test: Arguments, result: dict, solution: Callable | None,
+            invoker: SocketWrapper, **kwargs
+    ) -> Result:
+        if 'error' in result:
+            return Result(Verdict.CF, f'[test {i + 1}] {result["error"]}', invoker.id_, invoker.port)
+        if result['verdict'] != 'OK':
+            cause = f'[test {i + 1}] {result["message"]}'
+            return Result(Verdict[result['verdict']], cause, invoker.id_, invoker.port)
+        output = result['value']
+        reference = test
+        test = resolved(test)
+
+        answer = None
+        if solution is not None:
+            def compute():
+                return ANSWER_CACHE.answer(self.task, reference, lambda: safe_run(solution, test))
+            answer = compute() if self.suite is None else self.suite.answer(i, compute)
+            if isinstance(answer, Exception):
+                return Result(Verdict.CF, f'[test {i + 1}] error while running correct solution: {answer}')
+
+        check_result = self.task.checker.check(test, output, answer, **kwargs)
+        if check_result.verdict != Verdict.OK:
+            check_result.cause = f'[test {i + 1}] {check_result.cause}'
+            check_result.invoker_id = invoker.id_
+            check_result.invoker_port = invoker.port
+        return check_result
+
+    async def _run_shard(
+            self, shard: int, invoker: SocketWrapper, tests: list[Arguments], request: dict,
+            solution: Callable | None, fan_out: '_FanOut', **kwargs
+    ):
+        indices = fan_out.shards[shard]
+        try:
+            async with invoker:
+                bytes_in, bytes_out = invoker.bytes_in, invoker.bytes_out
+                try:
+                    request_id = await invoker.send(request | {'tests': [tests[i].args for i in indices]})
+                    timeout = SocketWrapper.response_timeout(self.task.time_limit)
+                    async with aclosing(invoker.receive_batch(request_id, len(indices), timeout)) as results:
+                        async for j, result in results:
+                            i = indices[j]
+                            fan_out.usage[i] = {key: result[key] for key in Runner.USAGE if key in result}
+                            if not fan_out.needs(i):
+                                return
+                            outcome = self._evaluate(i, tests[i], result, solution, invoker, **kwargs)
+                            if outcome.verdict != Verdict.OK:
+                                fan_out.fail(i, outcome)
+                                return
+                            fan_out.advance(shard, j + 1)
+                finally:
+                    fan_out.bytes_in += invoker.bytes_in - bytes_in
+                    fan_out.bytes_out += invoker.bytes_out - bytes_out
+        except FailedContainerException as e:
+            await report_fail(f'Invoker failed:\n```{e.logs.decode("utf-8")}```')
+            fan_out.fail(fan_out.pending(shard), Result(Verdict.CF, 'invoker failed', invoker.id_, invoker.port))
+        except OSError as e:
+            result = Result(Verdict.CF, f'invoker unavailable: {e}', invoker.id_, invoker.port)
+            fan_out.fail(fan_out.pending(shard), result)
+        except wire.WireError as e:
+            fan_out.fail(fan_out.pending(shard), Result(Verdict.CF, f'tests can not be sent to invoker: {e}'))
 
-    def _do_run(self, source: str, **kwargs) -> Result:
-        random = Random()
+    async def _do_run(self, source: str, **kwargs) -> Result:
         submission_source = '\n'.join(
             [include.source for include in self.task.include] +
             [source]
         )
-        tests = self.task.generate_tests(random)
-        for i, test in enumerate(tests):
-            answer = None
-            if self.task.solution is not None:
-                solution = self.task.solution
-                if self.task.executor is not None:
-                    solution = self.task.executor(solution)
-                answer = safe_run(solution, test)
-                if isinstance(answer, Exception):
-                    return Result(Verdict.CF, f'[test {i + 1}] error while running correct solution: {answer}')
-
-            invoker_id, invoker_port = None, None
-            try:
-                invoker = INVOKER_POOL.acquire()
-                invoker_id, invoker_port = invoker.id_, invoker.port
-                with invoker:
-                    invoker.send({
-                        'executor': (None if self.task.executor is None
-                                     else inspect.getsource(self.task.executor)),
-                        'source': submission_source,
-                        'args': test.args,
-                        'time_limit': self.task.time_limit
-                    })
-                    result = invoker.receive()
-            except FailedContainerException as e:
-                report_fail(f'Invoker failed:\n```{e.logs.decode("utf-8")}```')
-                return Result(Verdict.CF, 'invoker failed', invoker_id, invoker_port)
-
-            if 'error' in result:
-                cause = f'[test {i + 1}] {result["error"]}'
-                return Result(Verdict.CF, cause, invoker_id, invoker_port)
-            if result['verdict'] != 'OK':
-                cause = f'[test {i + 1}] {result["message"]}'
-                return Result(Verdict[result['verdict']], cause, invoker_id, invoker_port)
-            output = result['value']
-
-            check_result = self.task.checker.check(test, output, answer, **kwargs)
-            if check_result.verdict != Verdict.OK:
-                check_result.cause = f'[test {i + 1}] {check_result.cause}'
-                check_result.invoker_id = invoker_id
-                check_result.invoker_port = invoker_port
-                return check_result
-        return Result(Verdict.OK, None)
+        self.suite = Runner.prepare(self.task)
+        tests = self.task.generate_tests(Random()) if self.suite is None else self.suite.tests
+        if len(tests) == 0:
+            return Result(Verdict.OK, None)
+        solution = Runner.reference(self.task)
+
+        started = time.monotonic()
+        invokers = [await INVOKER_POOL.acquire()]
+        queue_wait = time.monotonic() - started
+        while len(invokers) < min(len(tests), Runner.MAX_SHARDS):
+            if (invoker := INVOKER_POOL.try_acquire()) is None:
+                break
+            invokers.append(invoker)
+
+        request = {
+            'executor': (None if self.task.executor is None
+                         else inspect.getsource(self.task.executor)),
+            'source': submission_source,
+            'time_limit': self.task.time_limit,
+            'memory_limit': self.task.memory_limit
+        }
+        fan_out = _FanOut(len(tests), len(invokers))
+        fan_out.tasks = [
+            asyncio.create_task(self._run_shard(shard, invoker, tests, request, solution, fan_out, **kwargs))
+            for shard, invoker in enumerate(invokers)
+        ]
+        for outcome in await asyncio.gather(*fan_out.tasks, return_exceptions=True):
+            if isinstance(outcome, Exception):
+                raise outcome
+
+        result = Result(Verdict.OK, None)
+        if fan_out.failure is not None:
+            result = fan_out.outcomes[fan_out.failure]
+        usage = fan_out.usage.values()
+        result.max_rss = max((test['max_rss'] for test in usage if 'max_rss' in test), default=None)
+        if any('cpu_time' in test for test in usage):
+            result.cpu_time = sum(test.get('cpu_time', 0) for test in usage)
+        self.metrics = {
+            'tests': len(fan_out.usage),
+            'cpu_time': result.cpu_time,
+            'max_cpu_time': max((test['cpu_time'] for test in usage if 'cpu_time' in test), default=None),
+            'wall_time': time.monotonic() - started,
+            'max_rss': result.max_rss,
+            'bytes_in': fan_out.bytes_in,
+            'bytes_out': fan_out.bytes_out,
+            'queue_wait': queue_wait,
+            'per_test': pack_tests(fan_out.usage)
+        }
+        return result
+
+    def store_metrics(self, run: Run):
+        if self.metrics is not None:
+            RunMetrics.replace(run=run, **self.metrics).execute()
 
     def store(
             self, source: FnCodeUnit, submission: Submission,
             result: Result
     ):
-        Run.create(
+        run = Run.create(
             task_id=self.task.id_,
             solution_source=source.source,
             solution_hash=Runner.solution_hash(source.node),
             submission=submission,
+            student_id=submission.student_id,
+            event=submission.event,
             verdict=result.verdict.name,
             comment=result.cause,
             invoker_id=result.invoker_id,
             invoker_port=result.invoker_port
         )
+        self.store_metrics(run)
 
-    def run(self, submission: Submission, source: FnCodeUnit) -> Result:
+    async def run(self, submission: Submission, source: FnCodeUnit) -> Result:
         kwargs = {}
         if self.task.extended_info:
             kwargs['student_id'] = submission.student.id_
-        result = self._do_run(source.source, **kwargs)
+        key = VERDICT_CACHE.key(self.task, source.node)
+        if (result := VERDICT_CACHE.get(key)) is None:
+            result = await self._do_run(source.source, **kwargs)
+            VERDICT_CACHE.put(self.task, key, result)
         self.store(source, submission, result)
         return result
 
@@ -141,14 +283,19 @@ class Runner:
                 kwargs = {}
                 if task.extended_info:
                     kwargs['student_id'] = submission.student.id_
-                result = Runner(task)._do_run(solution, **kwargs)
+                runner = Runner(task)
+                async with GRADING_SCHEDULER.submit(Priority.REJUDGE, submission.student_id):
+                    result = await runner._do_run(solution, **kwargs)
+                VERDICT_CACHE.put(task, VERDICT_CACHE.key(task, solution_ast), result)
 
                 results[run.id_] = result
                 run.verdict = result.verdict.name
                 run.comment = result.cause
+                run.solution_hash = Runner.solution_hash(solution_ast)
                 run.invoker_id = result.invoker_id
                 run.invoker_port = result.invoker_port
                 run.save()
+                runner.store_metrics(run)
                 await step_callback(results)
         finally:
             await final_callback(results)
@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import time
+from collections import deque, OrderedDict
+from enum import IntEnum
+from typing import Any, Hashable
+
+from botts.bot.config.local import INVOKER_CONFIG
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    REJUDGE = 1
+    BACKGROUND = 2
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Ticket:
+    def __init__(self, scheduler: 'GradingScheduler', priority: Priority, owner: Hashable):
+        self.scheduler = scheduler
+        self.priority = priority
+        self.owner = owner
+        self.enqueued = time.monotonic()
+        self.granted: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    @property
+    def queued(self) -> bool:
+        return not self.granted.done()
+
+    @property
+    def position(self) -> int:
+        return self.scheduler.position(self)
+
+    def cancel(self):
+        self.scheduler.cancel(self)
+
+    async def __aenter__(self) -> 'Ticket':
+        try:
+            await asyncio.shield(self.granted)
+        except asyncio.CancelledError:
+            self.cancel()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.cancel()
+
+
+class GradingScheduler:
+    CONCURRENCY = INVOKER_CONFIG.get('grading_concurrency', 4)
+    MAX_PENDING = INVOKER_CONFIG.get('max_pending', 2)
+    MAX_QUEUE = INVOKER_CONFIG.get('max_queue', 100)
+    WAIT_WINDOW = 256
+
+    def __init__(self, concurrency: int = CONCURRENCY):
+        self.concurrency = concurrency
+        # Per priority class, owners in round-robin order with their own FIFO of tickets
+        self.queues: dict[Priority, OrderedDict[Hashable, deque[Ticket]]] = {
+            priority: OrderedDict() for priority in Priority
+        }
+        self.running: set[Ticket] = set()
+        self.waits: dict[Priority, deque[float]] = {
+            priority: deque(maxlen=GradingScheduler.WAIT_WINDOW) for priority in Priority
+        }
+        self.granted = {priority: 0 for priority in Priority}
+        self.logger = logging.getLogger('scheduler')
+
+    def _pending(self, priority: Priority, owner: Hashable | None = None) -> int:
+        queue = self.queues[priority]
+        if owner is None:
+            return sum(len(tickets) for tickets in queue.values())
+        running = sum(ticket.priority == priority and ticket.owner == owner for ticket in self.running)
+        return len(queue.get(owner, ())) + running
+
+    def submit(self, priority: Priority, owner: Hashable) -> Ticket:
+        # Only interactive submissions are bounded, rejudges and background jobs are queued by staff
+        if priority == Priority.INTERACTIVE:
+            if self._pending(priority, owner) >= GradingScheduler.MAX_PENDING:
+                raise QueueFull(f'{owner} already has {GradingScheduler.MAX_PENDING} submissions in testing')
+            if self._pending(priority) >= GradingScheduler.MAX_QUEUE:
+                raise QueueFull(f'{GradingScheduler.MAX_QUEUE} submissions are already waiting')
+
+        ticket = Ticket(self, priority, owner)
+        self.queues[priority].setdefault(owner, deque()).append(ticket)
+        self._dispatch()
+        return ticket
+
+    def _next(self) -> Ticket | None:
+        for priority in Priority:
+            queue = self.queues[priority]
+            if not queue:
+                continue
+            owner, tickets = next(iter(queue.items()))
+            ticket = tickets.popleft()
+            del queue[owner]
+            if tickets:
+                queue[owner] = tickets
+            return ticket
+        return None
+
+    def _dispatch(self):
+        while len(self.running) < self.concurrency and (ticket := self._next()) is not None:
+            self.running.add(ticket)
+            self.waits[ticket.priority].append(time.monotonic() - ticket.enqueued)
+            self.granted[ticket.priority] += 1
+            ticket.granted.set_result(None)
+
+    def cancel(self, ticket: Ticket):
+        if ticket in self.running:
+            self.running.discard(ticket)
+        else:
+            tickets = self.queues[ticket.priority].get(ticket.owner)
+            if tickets is not None and ticket in tickets:
+                tickets.remove(ticket)
+                if not tickets:
+                    del self.queues[ticket.priority][ticket.owner]
+            if not ticket.granted.done():
+                ticket.granted.cancel()
+        self._dispatch()
+
+    def position(self, ticket: Ticket) -> int:
+        """Number of queued tickets that will be granted before this one, 0 once it runs"""
+        tickets = self.queues[ticket.priority].get(ticket.owner)
+        if tickets is None or ticket not in tickets:
+            return 0
+        ahead = sum(self._pending(priority) for priority in Priority if priority < ticket.priority)
+        index = tickets.index(ticket)
+        for owner, others in self.queues[ticket.priority].items():
+            if owner == ticket.owner:
+                # Owners earlier in the round order are served once more before this ticket than the later ones
+                ahead += index
+                index -= 1
+                continue
+            ahead += min(len(others), index + 1)
+        return ahead
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'running': len(self.running),
+            'concurrency': self.concurrency,
+            'classes': {
+                priority.name.lower(): {
+                    'queued': self._pending(priority),
+                    'owners': len(self.queues[priority]),
+                    'granted': self.granted[priority],
+                    'mean_wait': sum(waits) / len(waits) if (waits := self.waits[priority]) else 0.0,
+                    'max_wait': max(waits, default=0.0),
+                    'oldest': max(
+                        (time.monotonic() - tickets[0].enqueued for tickets in self.queues[priority].values()),
+                        default=0.0
+                    )
+                }
+                for priority in Priority
+            }
+        }
+
+
+GRADING_SCHEDULER = GradingScheduler()
@@ -0,0 +1,80 @@
+import logging
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from random import Random
+from typing import Any, Callable
+
+from common.testsys import wire
+from .answer_cache import AnswerCache
+from ..base.task import Task
+from ..base.version import task_version
+from ..check.generator import Arguments
+
+
+@dataclass
+class Suite:
+    version: str
+    tests: list[Arguments]
+    answers: list[bytes | None]
+
+    def answer(self, i: int, compute: Callable[[], Any]) -> Any:
+        # Answers stay encoded so that a checker mutating one can not affect the next submission
+        if self.answers[i] is None:
+            return compute()
+        return wire.loads(self.answers[i])
+
+
+class SuiteStore:
+    DIRECTORY = Path('suites')
+
+    def __init__(self):
+        self.suites: dict[int, Suite] = {}
+        self.logger = logging.getLogger('suites')
+
+    @staticmethod
+    def _path(task: Task, version: str) -> Path:
+        return SuiteStore.DIRECTORY / f'{task.id_}.{version}.suite'
+
+    def _load(self, path: Path, version: str) -> Suite | None:
+        try:
+            data = wire.loads(path.read_bytes())
+        except (OSError, wire.WireError):
+            return None
+        return Suite(version, [Arguments(args, kwargs) for args, kwargs in data['tests']], data['answers'])
+
+    def _materialize(self, task: Task, version: str, solve: Callable[[Arguments], Any] | None) -> Suite:
+        tests = task.generate_tests(Random(task.seed))
+        answers = [None if solve is None or not task.cache_answers else AnswerCache.encode(solve(test)) for test in tests]
+        suite = Suite(version, tests, answers)
+
+        path = SuiteStore._path(task, version)
+        try:
+            SuiteStore.DIRECTORY.mkdir(exist_ok=True)
+            temporary = path.with_suffix('.tmp')
+            temporary.write_bytes(wire.dumps({
+                'tests': [(test.args, test.kwargs) for test in tests],
+                'answers': answers
+            }))
+            os.replace(temporary, path)
+            for stale in SuiteStore.DIRECTORY.glob(f'{task.id_}.*.suite'):
+                if stale != path:
+                    stale.unlink(missing_ok=True)
+        except (OSError, wire.WireError) as e:
+            self.logger.warning(f'Suite of task {task.id_} can not be stored: {e}')
+        return suite
+
+    def get(self, task: Task, solve: Callable[[Arguments], Any] | None) -> Suite | None:
+        if task.seed is None:
+            return None
+        if id(task) not in self.suites:
+            version = task_version(task)
+            suite = self._load(SuiteStore._path(task, version), version)
+            if suite is None:
+                self.logger.info(f'Materializing suite of task {task.id_}, version {version}')
+                suite = self._materialize(task, version, solve)
+            self.suites[id(task)] = suite
+        return self.suites[id(task)]
+
+
+SUITES = SuiteStore()
@@ -0,0 +1,69 @@
+import ast
+import hashlib
+import inspect
+import sys
+
+from botts.db.cached_verdict import CachedVerdict
+from botts.db.util.lru import LruTable
+from ..base.fingerprint import fingerprint
+from ..base.task import Task
+from ..base.version import task_version
+from ..check.checker import Result, Verdict
+
+
+class VerdictCache:
+    # Infrastructure failures and resource limits depend on the host rather than the solution
+    TRANSIENT = (Verdict.CF, Verdict.TL, Verdict.ML)
+    # Runtime errors reported by the sandbox itself rather than raised by the solution
+    HOST_FAILURES = ('process exited with code', 'worker exited unexpectedly', 'killed by signal', 'malformed result')
+
+    def __init__(self):
+        self.versions: dict[int, str] = {}
+        self.table = LruTable(CachedVerdict)
+
+    @staticmethod
+    def cacheable(task: Task) -> bool:
+        return task.cache_verdicts and task.deterministic and not task.extended_info and not task.checker.stateful
+
+    @staticmethod
+    def transient(result: Result) -> bool:
+        if result.verdict in VerdictCache.TRANSIENT:
+            return True
+        return result.verdict == Verdict.RE and any(failure in (result.cause or '') for failure in VerdictCache.HOST_FAILURES)
+
+    def _version(self, task: Task) -> str:
+        if id(task) not in self.versions:
+            digest = hashlib.blake2b(task_version(task).encode(), digest_size=16)
+            digest.update(f'{task.time_limit}:{task.memory_limit}'.encode())
+            for include in task.include:
+                digest.update(include.source.encode())
+            try:
+                digest.update(inspect.getsource(sys.modules[type(task.checker).__module__]).encode())
+            except (KeyError, OSError, TypeError):
+                digest.update(type(task.checker).__qualname__.encode())
+            self.versions[id(task)] = digest.hexdigest()
+        return self.versions[id(task)]
+
+    def key(self, task: Task, node: ast.AST) -> str | None:
+        if not VerdictCache.cacheable(task):
+            return None
+        return f'{task.id_}:{self._version(task)}:{fingerprint(node, rename=False)}'
+
+    def get(self, key: str | None) -> Result | None:
+        if key is None:
+            return None
+        if (entry := self.table.get(key)) is None:
+            return None
+        return Result(Verdict[entry.verdict], entry.comment, max_rss=entry.max_rss, cpu_time=entry.cpu_time)
+
+    def put(self, task: Task, key: str | None, result: Result):
+        if key is None or VerdictCache.transient(result):
+            return
+        self.table.put(
+            key, task_id=task.id_,
+            verdict=result.verdict.name, comment=result.cause,
+            max_rss=result.max_rss, cpu_time=result.cpu_time
+        )
+
+
+VERDICT_CACHE = VerdictCache()
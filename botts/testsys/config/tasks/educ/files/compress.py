@@ -1,5 +1,4 @@
 import textwrap
-import json
 from typing import Any
 
 from botts.testsys.components.base.include import inc
@@ -8,6 +7,7 @@ from botts.testsys.components.check.checker import Checker, Result, Verdict
 from botts.testsys.components.check.generator import ArgList
 from botts.testsys.components.check.validator import NO_IMPORTS, NO_EXEC, NO_EVAL
 from botts.testsys.components.extract.jupyter import FnLocator
+from common.testsys.fixtures import fixture
 
 
 def compress_executor(fn):
@@ -59,6 +59,8 @@ database.create_tables([CRTable], safe=True)
 
 
 class EncodeDecodeChecker(Checker):
+    stateful = True
+
     def check(self, in_data: Any, out_data: Any, answer: Any, **kwargs) -> Result:
         r_p, sz_p = out_data
         _, sz_a = answer
@@ -98,8 +100,7 @@ def solution():
     return pickle.dump, pickle.load
 
 
-with open('resources/tests/fixtures/large-json.json', 'r') as f:
-    LARGE_JSON = json.load(f)
+LARGE_JSON = fixture('large-json.json')
 
 
 
@@ -37,5 +37,6 @@ TASK = Task(
     checker=SequenceOf(SINGLE_FLOAT_6),
     tests=_TASK_divide.tests,
     solution=solution,
-    time_limit=3
+    time_limit=3,
+    memory_limit=512
 )
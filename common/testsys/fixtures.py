@@ -0,0 +1,62 @@
+import functools
+import hashlib
+import json
+import mmap
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+FIXTURES_DIR = Path(__file__).parent.parent.parent / 'resources' / 'tests' / 'fixtures'
+DIGEST_SIZE = 16
+
+
+class FixtureError(LookupError):
+    pass
+
+
+@dataclass(frozen=True)
+class FixtureRef:
+    name: str
+    digest: str
+
+    def __repr__(self):
+        return f'<fixture {self.name}>'
+
+
+def _read(name: str) -> tuple[str, bytes]:
+    path = FIXTURES_DIR / name
+    if path.parent != FIXTURES_DIR:
+        raise FixtureError(f'invalid fixture name \'{name}\'')
+    try:
+        with open(path, 'rb') as file:
+            if path.stat().st_size == 0:
+                return hashlib.blake2b(digest_size=DIGEST_SIZE).hexdigest(), b''
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return hashlib.blake2b(data, digest_size=DIGEST_SIZE).hexdigest(), data[:]
+    except OSError as e:
+        raise FixtureError(f'can not read fixture \'{name}\': {e}')
+
+
+def fixture(name: str) -> FixtureRef:
+    digest, _ = _read(name)
+    return FixtureRef(name, digest)
+
+
+@functools.cache
+def _load(name: str, digest: str) -> Any:
+    actual, data = _read(name)
+    if actual != digest:
+        raise FixtureError(f'fixture \'{name}\' has digest {actual}, expected {digest}')
+    if name.endswith('.json'):
+        return json.loads(data)
+    return data
+
+
+def load(ref: FixtureRef) -> Any:
+    return _load(ref.name, ref.digest)
+
+
+def resolve(args: tuple) -> tuple:
+    if not any(isinstance(arg, FixtureRef) for arg in args):
+        return args
+    return tuple(load(arg) if isinstance(arg, FixtureRef) else arg for arg in args)
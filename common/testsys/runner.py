@@ -1,7 +1,10 @@
+import os
 from dataclasses import dataclass, field
 from enum import Enum
 from typing import Any
 
+WALL_TIME_FACTOR = int(os.getenv('INVOKER_WALL_TIME_FACTOR', '3'))
+
 
 class Verdict(Enum):
     MS = "Missing"
@@ -11,6 +14,7 @@ class Verdict(Enum):
     WA = "Wrong Answer"
     RE = "Runtime Error"
     TL = "Time Limit Exceeded"
+    ML = "Memory Limit Exceeded"
     OK = "Correct"
 
 
@@ -19,3 +23,8 @@ class TestingResult:
     verdict: Verdict
     message: str | None
     value: Any = field(default=None)
+
+
+def wall_limit(time_limit: int | float) -> int | float:
+    # Time limits are CPU time, the wall clock only catches solutions that sleep or block
+    return max(time_limit * WALL_TIME_FACTOR, time_limit + 1)
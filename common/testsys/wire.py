@@ -0,0 +1,172 @@
+import importlib
+import struct
+from typing import Any
+
+import msgpack
+
+# Frame layout: magic (2 bytes), protocol version (1 byte), payload size (8 bytes, big-endian), payload.
+# Payload is a single msgpack value; what msgpack has no type for travels as extension types below.
+MAGIC = b'BT'
+VERSION = 2
+HEADER = struct.Struct('>2sBQ')
+
+# Classes from these modules exist on both sides of the socket and may be transferred by reference
+SHARED_MODULES = ('resources.', 'common.testsys.fixtures')
+
+_TUPLE, _SET, _FROZENSET, _COMPLEX, _INT, _TYPE, _OBJECT = range(1, 8)
+
+_COMPLEX_PARTS = struct.Struct('>dd')
+_BUILDERS = {_TUPLE: tuple, _SET: set, _FROZENSET: frozenset}
+_INT_MIN, _INT_MAX = -1 << 63, (1 << 64) - 1
+
+REQUEST = {
+    'id': int,
+    'cancel': bool,
+    'ping': bool,
+    'executor': (str, type(None)),
+    'source': str,
+    'args': tuple,
+    'tests': list,
+    'time_limit': (int, float),
+    'memory_limit': (int, type(None)),
+}
+RESPONSE = {
+    'id': int,
+    'index': int,
+    'done': bool,
+    'verdict': str,
+    'value': object,
+    'message': (str, type(None)),
+    'error': str,
+    'pong': dict,
+    'cpu_time': float,
+    'wall_time': float,
+    'max_rss': int,
+}
+
+
+class WireError(ValueError):
+    pass
+
+
+def _shared(cls: type) -> bool:
+    return cls.__module__.startswith(SHARED_MODULES)
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, type) and _shared(value):
+        return msgpack.ExtType(_TYPE, _dumps([value.__module__, value.__qualname__]))
+    if _shared(type(value)) and hasattr(value, '__dict__'):
+        return msgpack.ExtType(_OBJECT, _dumps([type(value).__module__, type(value).__qualname__, vars(value)]))
+    # Subclasses of the builtin types (named tuples, defaultdicts, int enums, ...) degrade to their base
+    if isinstance(value, tuple):
+        return msgpack.ExtType(_TUPLE, _dumps(list(value)))
+    if isinstance(value, frozenset):
+        return msgpack.ExtType(_FROZENSET, _dumps(list(value)))
+    if isinstance(value, set):
+        return msgpack.ExtType(_SET, _dumps(list(value)))
+    if isinstance(value, int):
+        if _INT_MIN <= value <= _INT_MAX:
+            return int(value)
+        return msgpack.ExtType(_INT, value.to_bytes((value.bit_length() + 8) // 8, 'big', signed=True))
+    if isinstance(value, complex):
+        return msgpack.ExtType(_COMPLEX, _COMPLEX_PARTS.pack(value.real, value.imag))
+    for base in (float, str, bytes, list, dict):
+        if isinstance(value, base):
+            return base(value)
+    raise WireError(f'values of type \'{type(value).__name__}\' can not be transferred')
+
+
+def _resolve(module_name: Any, qualname: Any) -> type:
+    if not isinstance(module_name, str) or not isinstance(qualname, str):
+        raise WireError('malformed class name')
+    if not module_name.startswith(SHARED_MODULES):
+        raise WireError(f'module \'{module_name}\' is not shared')
+    try:
+        value = importlib.import_module(module_name)
+        for part in qualname.split('.'):
+            value = getattr(value, part)
+    except (ImportError, AttributeError) as e:
+        raise WireError(f'can not resolve \'{module_name}.{qualname}\': {e}')
+    if not isinstance(value, type):
+        raise WireError(f'\'{module_name}.{qualname}\' is not a class')
+    return value
+
+
+def _ext_hook(code: int, data: bytes) -> Any:
+    if code in _BUILDERS:
+        return _BUILDERS[code](_loads(data))
+    if code == _INT:
+        return int.from_bytes(data, 'big', signed=True)
+    if code == _COMPLEX:
+        return complex(*_COMPLEX_PARTS.unpack(data))
+    if code == _TYPE:
+        return _resolve(*_loads(data))
+    if code == _OBJECT:
+        module_name, qualname, state = _loads(data)
+        cls = _resolve(module_name, qualname)
+        if not isinstance(state, dict):
+            raise WireError(f'expected a dictionary as the state of \'{cls.__name__}\'')
+        value = cls.__new__(cls)
+        value.__dict__.update(state)
+        return value
+    raise WireError(f'unknown extension type {code}')
+
+
+def _dumps(value: Any) -> bytes:
+    return msgpack.packb(
+        value, default=_default, strict_types=True, use_bin_type=True, unicode_errors='surrogatepass'
+    )
+
+
+def _loads(data: bytes | bytearray | memoryview) -> Any:
+    return msgpack.unpackb(
+        data, ext_hook=_ext_hook, raw=False, strict_map_key=False, unicode_errors='surrogatepass'
+    )
+
+
+def dumps(value: Any) -> bytes:
+    try:
+        return _dumps(value)
+    except WireError:
+        raise
+    except RecursionError:
+        raise WireError('value is nested too deeply')
+    except (ValueError, TypeError, OverflowError) as e:
+        raise WireError(f'value can not be encoded: {e}')
+
+
+def loads(data: bytes | bytearray | memoryview) -> Any:
+    try:
+        return _loads(data)
+    except WireError:
+        raise
+    except RecursionError:
+        raise WireError('value is nested too deeply')
+    except (ValueError, TypeError, AttributeError) as e:
+        raise WireError(f'malformed data: {str(e) or type(e).__name__}')
+
+
+def pack(value: Any) -> bytes:
+    payload = dumps(value)
+    return HEADER.pack(MAGIC, VERSION, len(payload)) + payload
+
+
+def unpack_header(header: bytes | bytearray | memoryview) -> int:
+    magic, version, size = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise WireError(f'invalid frame magic {bytes(magic)}')
+    if version != VERSION:
+        raise WireError(f'unsupported protocol version {version}')
+    return size
+
+
+def check(message: Any, schema: dict[str, type | tuple[type, ...]]) -> str | None:
+    if not isinstance(message, dict):
+        return f'expected a dictionary, got \'{type(message).__name__}\''
+    for key, value in message.items():
+        if key not in schema:
+            return f'unexpected field \'{key}\''
+        if not isinstance(value, schema[key]):
+            return f'field \'{key}\' can not be of type \'{type(value).__name__}\''
+    return None
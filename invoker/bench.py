@@ -0,0 +1,69 @@
+import json
+import socket
+import sys
+import threading
+import time
+from pathlib import Path
+
+from common.testsys import wire
+from invoker.common import InvokerServiceBase
+
+FIXTURE = Path(__file__).parent.parent / 'resources' / 'tests' / 'fixtures' / 'large-json.json'
+
+
+def _legacy_read_frame(conn: socket.socket) -> bytes | None:
+    def read(size: int):
+        data = bytes()
+        while len(data) < size:
+            chunk = conn.recv(min(1024, size - len(data)))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    header = read(wire.HEADER.size)
+    if header is None:
+        return None
+    return read(wire.unpack_header(header))
+
+
+def _measure(read_frame, package: bytes, rounds: int) -> float:
+    receiver, sender = socket.socketpair()
+    with receiver, sender:
+        def send():
+            for _ in range(rounds):
+                sender.sendall(package)
+
+        thread = threading.Thread(target=send, daemon=True)
+        start = time.perf_counter()
+        thread.start()
+        for _ in range(rounds):
+            read_frame(receiver)
+        elapsed = time.perf_counter() - start
+        thread.join()
+    return elapsed
+
+
+def main(copies: int = 100, rounds: int = 20):
+    with open(FIXTURE) as file:
+        large_json = json.load(file)
+    package = bytes(wire.pack({
+        'id': 1,
+        'executor': None,
+        'source': 'def f(x):\n    return x\n',
+        'tests': [(large_json,)] * copies,
+        'time_limit': 10
+    }))
+    megabytes = len(package) * rounds / (1 << 20)
+    print(f'Frame of {len(package) / (1 << 20):.2f} MiB, {rounds} rounds')
+
+    results = {}
+    for name, read_frame in [('legacy', _legacy_read_frame), ('recv_into', InvokerServiceBase._read_frame)]:
+        elapsed = _measure(read_frame, package, rounds)
+        results[name] = elapsed
+        print(f'{name:>10}: {elapsed:.3f}s, {megabytes / elapsed:.1f} MiB/s')
+    print(f'Speedup: {results["legacy"] / results["recv_into"]:.1f}x')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
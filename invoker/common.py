@@ -1,14 +1,17 @@
 import ast
 import logging
 import os
-import pickle
 import shutil
 import socket
+import threading
 from abc import ABC, abstractmethod
 from dataclasses import dataclass, field
-from typing import Any
+from queue import Queue
+from typing import Any, Callable
 from uuid import uuid4
 
+from common.testsys import fixtures, runner, wire
+
 logging.basicConfig(level=logging.INFO)
 
 
@@ -16,8 +19,73 @@ logging.basicConfig(level=logging.INFO)
 class Request:
     executor: str | None
     source: str
-    args: tuple
+    args: tuple | None = field(default=None)
+    tests: list[tuple] | None = field(default=None)
     time_limit: int = field(default=1)
+    memory_limit: int | None = field(default=None)
+    id: int = field(default=0)
+
+    @property
+    def is_batch(self) -> bool:
+        return self.tests is not None
+
+
+@dataclass
+class Cancel:
+    id: int
+
+
+@dataclass
+class Ping:
+    id: int
+
+
+class Cancelled(Exception):
+    pass
+
+
+class Emitter:
+    def __init__(
+            self, connection: 'Connection', request_id: int,
+            transform: Callable[[dict[str, Any]], dict[str, Any]] | None = None
+    ):
+        self.connection = connection
+        self.request_id = request_id
+        self.transform = transform
+
+    @property
+    def cancelled(self) -> bool:
+        return self.connection.closed.is_set() or self.request_id in self.connection.cancelled
+
+    def map(self, transform: Callable[[dict[str, Any]], dict[str, Any]]) -> 'Emitter':
+        # Runners poll `cancelled` while a test runs, so wrappers have to stay emitters rather than plain lambdas
+        if self.transform is None:
+            return Emitter(self.connection, self.request_id, transform)
+        return Emitter(self.connection, self.request_id, lambda response: transform(self.transform(response)))
+
+    def __call__(self, response: dict[str, Any]):
+        if self.cancelled:
+            raise Cancelled()
+        if self.transform is not None:
+            response = self.transform(response)
+        self.connection.send(response | {'id': self.request_id})
+
+
+class Connection:
+    def __init__(self, conn: socket.socket):
+        self.conn = conn
+        self.lock = threading.Lock()
+        self.closed = threading.Event()
+        self.cancelled: set[int] = set()
+        self.requests: Queue[Request | None] = Queue()
+
+    def send(self, response: dict[str, Any]):
+        package = wire.pack(response)
+        with self.lock:
+            self.conn.sendall(package)
+
+    def emitter(self, request_id: int) -> Emitter:
+        return Emitter(self, request_id)
 
 
 class ChrootJail:
@@ -45,14 +113,41 @@ class ChrootJail:
         return wrapped
 
 
+def cpu_quota() -> int:
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as file:
+            quota, period = file.read().split()
+        if quota != 'max':
+            return max(1, int(quota) // int(period))
+    except (OSError, ValueError):
+        pass
+    try:
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as quota_file, \
+                open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as period_file:
+            quota, period = int(quota_file.read()), int(period_file.read())
+        if quota > 0:
+            return max(1, quota // period)
+    except (OSError, ValueError):
+        pass
+    return len(os.sched_getaffinity(0))
+
+
 class InvokerServiceBase(ABC):
-    BATCH_SIZE = 1024
+    BATCH_SIZE = 1 << 20
+    MAX_FRAME_SIZE = 1 << 30
+    SANDBOXES = int(os.getenv('INVOKER_SANDBOXES', '0')) or cpu_quota()
+    MEMORY_LIMIT = int(os.getenv('INVOKER_MEMORY_LIMIT', '0'))
 
     def __init__(self, port: int):
         self.host = '0.0.0.0'
         self.port = port
         self.logger = logging.getLogger('invoker')
         self.run_id = uuid4()
+        self.sandbox = threading.BoundedSemaphore(InvokerServiceBase.SANDBOXES)
+
+    @staticmethod
+    def wall_limit(time_limit: int | float) -> int | float:
+        return runner.wall_limit(time_limit)
 
     @staticmethod
     def _extract_function_name(source):
@@ -64,28 +159,49 @@ class InvokerServiceBase(ABC):
         return fn_name
 
     @abstractmethod
-    def run(self, source: ast.AST, args: tuple, time_limit: int, response: dict[str, Any]):
+    def run(
+            self, source: ast.AST, args: tuple, time_limit: int, response: dict[str, Any],
+            memory_limit: int | None = None
+    ):
         pass
 
-    def validate(self, input_data: str | bytes, response: dict[str, Any]) -> Request | None:
+    def run_batch(
+            self, source: ast.AST, tests: list[tuple], time_limit: int,
+            emit: Emitter, memory_limit: int | None = None
+    ):
+        for i, args in enumerate(tests):
+            response = {'index': i}
+            self.run(source, args, time_limit, response, memory_limit)
+            emit(response)
+            if response.get('verdict') != 'OK':
+                break
+
+    def validate(self, input_data: bytes | memoryview, response: dict[str, Any]) -> Request | Cancel | Ping | None:
         try:
-            request = pickle.loads(input_data)
+            request = wire.loads(input_data)
             self.logger.info(f'Received data parsed into {request}')
-        except pickle.UnpicklingError as e:
-            self.logger.warning(f'Request is malformed: not parseable by `pickle`, {e}')
-            response['error'] = f'expected a valid pickle, got {input_data}'
+        except wire.WireError as e:
+            self.logger.warning(f'Request is malformed: not decodable, {e}')
+            response['error'] = f'expected a valid frame payload, {e}'
             return
-        if not isinstance(request, dict):
-            self.logger.warning('Request is malformed: not a dictionary')
-            response['error'] = f'expected a dictionary, got {request}'
+        if (error := wire.check(request, wire.REQUEST)) is not None:
+            self.logger.warning(f'Request is malformed: {error}')
+            if isinstance(request, dict) and isinstance(request.get('id'), int):
+                response['id'] = request['id']
+            response['error'] = error
             return
-        if 'source' not in request or 'args' not in request:
+        response['id'] = request.get('id', 0)
+        if request.pop('cancel', False):
+            return Cancel(response['id'])
+        if request.pop('ping', False):
+            return Ping(response['id'])
+        if 'source' not in request or ('args' not in request and 'tests' not in request):
             self.logger.warning(f'Request is malformed: not enough fields')
-            response['error'] = 'expected keys \'source\' and \'args\' in request'
+            response['error'] = 'expected keys \'source\' and \'args\' or \'tests\' in request'
             return
-        if not isinstance(request['args'], tuple):
+        if 'tests' in request and not all(isinstance(args, tuple) for args in request['tests']):
             self.logger.warning(f'Request is malformed: invalid input data')
-            response['error'] = f'expected request[\'args\'] to be a tuple, got {request["args"]}'
+            response['error'] = f'expected request[\'tests\'] to be a list of tuples, got {request["tests"]}'
             return
 
         source = request['source']
@@ -99,44 +215,140 @@ class InvokerServiceBase(ABC):
             return
         return Request(**request)
 
-    def process(self, conn: socket.socket):
-        def read(size: int):
-            data = bytes()
-            while len(data) < size:
-                data += conn.recv(InvokerServiceBase.BATCH_SIZE)
-            return data[:size]
+    @staticmethod
+    def _assemble(request: Request) -> ast.Module:
+        source = request.source
+        if request.executor is not None:
+            ex = ast.parse(request.executor)
+            ex_name = InvokerServiceBase._extract_function_name(ex)
+
+            src = ast.parse(source)
+            fn_name = InvokerServiceBase._extract_function_name(src)
+
+            source = '\n'.join([
+                source,
+                request.executor,
+                f'{fn_name} = {ex_name}({fn_name})'
+            ])
+        return ast.parse(source)
+
+    def _resolve_fixtures(self, request: Request):
+        if request.is_batch:
+            request.tests = [fixtures.resolve(args) for args in request.tests]
+        else:
+            request.args = fixtures.resolve(request.args)
+
+    def _execute(self, request: Request, emit: Emitter):
+        try:
+            self._resolve_fixtures(request)
+        except fixtures.FixtureError as e:
+            self.logger.warning(f'Request references a missing fixture: {e}')
+            emit({'error': str(e), 'done': True})
+            return
+
+        fn = InvokerServiceBase._assemble(request)
+        memory_limit = request.memory_limit or InvokerServiceBase.MEMORY_LIMIT or None
+        if not request.is_batch:
+            # A single run is a batch of one, so that it can be cancelled in the middle just the same
+            self.run_batch(
+                fn, [request.args], request.time_limit,
+                emit.map(lambda response: {k: v for k, v in response.items() if k != 'index'} | {'done': True}),
+                memory_limit
+            )
+            self.logger.info('Run processed')
+            return
 
+        last = len(request.tests) - 1
+        if last < 0:
+            emit({'done': True})
+            return
+        self.run_batch(
+            fn, request.tests, request.time_limit,
+            emit.map(lambda response: response | {
+                'done': response.get('verdict') != 'OK' or response.get('index') == last
+            }),
+            memory_limit
+        )
+        self.logger.info(f'Batch of {len(request.tests)} tests processed')
+
+    def _serve(self, connection: Connection):
+        while (request := connection.requests.get()) is not None:
+            if connection.closed.is_set():
+                break
+            if request.id in connection.cancelled:
+                continue
+            try:
+                with self.sandbox:
+                    self._execute(request, connection.emitter(request.id))
+            except Cancelled:
+                self.logger.info(f'Request {request.id} cancelled')
+            except OSError as e:
+                self.logger.warning(f'Connection failed while responding: {e}')
+                break
+
+    @staticmethod
+    def _read_exactly(conn: socket.socket, size: int) -> memoryview | None:
+        buffer = memoryview(bytearray(size))
+        received = 0
+        while received < size:
+            count = conn.recv_into(buffer[received:], min(InvokerServiceBase.BATCH_SIZE, size - received))
+            if count == 0:
+                return None
+            received += count
+        return buffer
+
+    @staticmethod
+    def _read_frame(conn: socket.socket) -> memoryview | None:
+        header = InvokerServiceBase._read_exactly(conn, wire.HEADER.size)
+        if header is None:
+            return None
+        size = wire.unpack_header(header)
+        if size > InvokerServiceBase.MAX_FRAME_SIZE:
+            raise wire.WireError(f'frame of {size} bytes exceeds the limit')
+        return InvokerServiceBase._read_exactly(conn, size)
+
+    def process(self, conn: socket.socket):
+        connection = Connection(conn)
+        workers = [
+            threading.Thread(target=self._serve, args=(connection,), daemon=True)
+            for _ in range(InvokerServiceBase.SANDBOXES)
+        ]
+        for worker in workers:
+            worker.start()
         with conn:
-            size = int.from_bytes(conn.recv(8))
-            input_data = read(size)
-            response = {}
-            self.logger.info(f'Received request {input_data}')
-            request = self.validate(input_data, response)
-            if request:
-                source = request.source
-                if request.executor is not None:
-                    ex = ast.parse(request.executor)
-                    ex_name = InvokerServiceBase._extract_function_name(ex)
-
-                    src = ast.parse(source)
-                    fn_name = InvokerServiceBase._extract_function_name(src)
-
-                    source = '\n'.join([
-                        source,
-                        request.executor,
-                        f'{fn_name} = {ex_name}({fn_name})'
-                    ])
-                fn = ast.parse(source)
-                self.run(fn, request.args, request.time_limit, response)
-                self.logger.info(f'Run successful, response is {response}')
-
-            response['package'] = pickle.dumps(response)
-            conn.send(len(response['package']).to_bytes(8))
-            conn.send(response['package'])
-            conn.close()
+            try:
+                while (input_data := InvokerServiceBase._read_frame(conn)) is not None:
+                    response = {}
+                    self.logger.info(f'Received request of {len(input_data)} bytes')
+                    request = self.validate(input_data, response)
+                    if request is None:
+                        connection.send(response | {'done': True})
+                    elif isinstance(request, Cancel):
+                        connection.cancelled.add(request.id)
+                    elif isinstance(request, Ping):
+                        connection.send(response | {'pong': self.health(), 'done': True})
+                    else:
+                        connection.requests.put(request)
+            except wire.WireError as e:
+                self.logger.warning(f'Connection dropped, invalid frame: {e}')
+            except OSError as e:
+                self.logger.warning(f'Connection failed while reading: {e}')
+            finally:
+                connection.closed.set()
+                for _ in workers:
+                    connection.requests.put(None)
+                for worker in workers:
+                    worker.join()
+        self.logger.info('Connection closed')
+
+    def health(self) -> dict[str, Any]:
+        return {'sandboxes': InvokerServiceBase.SANDBOXES}
+
+    def accepts(self, addr: tuple[str, int]) -> bool:
+        return True
 
     def start(self):
-        self.logger.info('Starting service...')
+        self.logger.info(f'Starting service with {InvokerServiceBase.SANDBOXES} sandboxes...')
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             s.bind((self.host, self.port))
             s.listen()
@@ -144,4 +356,8 @@ class InvokerServiceBase(ABC):
             while True:
                 conn, addr = s.accept()
                 self.logger.info(f'Connection by {addr}')
-                self.process(conn)
+                if not self.accepts(addr):
+                    self.logger.info('Not a host IP, ignoring connection')
+                    conn.close()
+                    continue
+                threading.Thread(target=self.process, args=(conn,), daemon=True).start()
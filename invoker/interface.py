@@ -1,3 +1,4 @@
+import os
 from pprint import pp
 
 import docker
@@ -12,34 +13,57 @@ def _extract_port(container: Container):
     return int(ports[0]['HostPort'])
 
 
+def _extract_capacity(container: Container, default: int) -> int:
+    for variable in container.attrs['Config'].get('Env') or []:
+        name, _, value = variable.partition('=')
+        if name == 'INVOKER_SANDBOXES' and int(value) > 0:
+            return int(value)
+    host_config = container.attrs['HostConfig']
+    if host_config.get('NanoCpus'):
+        return max(1, host_config['NanoCpus'] // 10 ** 9)
+    if (host_config.get('CpuQuota') or 0) > 0:
+        return max(1, host_config['CpuQuota'] // (host_config.get('CpuPeriod') or 100000))
+    return default
+
+
 class ContainersHolder:
-    def __init__(self, containers: list[Container]):
+    def __init__(self, containers: list[Container], cpus: int = 1):
         self.port_mapping = {
             _extract_port(cnt): cnt
             for cnt in containers
             if cnt.status == 'running'
         }
+        # Containers without a CPU limit share the host, each one gets its part of it
+        default_capacity = max(1, cpus // max(1, len(self.port_mapping)))
+        self.capacity = {
+            port: _extract_capacity(cnt, default_capacity)
+            for port, cnt in self.port_mapping.items()
+        }
         self._id_mapping = {cnt.id: cnt for cnt in containers}
 
     def get_by_id(self, id_: str) -> Container | None:
         return self._id_mapping.get(id_)
 
 
-class Client:
-    def __init__(self):
-        context = read_terminal(
-            'docker info | '
-            'awk \'/[[:blank:]]*Context/ '
-            '{ split($0,a,":"); gsub(/[[:blank:]]/,"",a[2]); print a[2] }\''
-        )
-        endpoint = read_terminal(
-            'docker context ls | '
-            f'awk \'$1=="{context}" '
-            '{ for(i=1;i<=NF;i++) { if($i~/.*\\.sock/) { print $i } } }\''
-        )
+def _context_endpoint() -> str:
+    context = read_terminal(
+        'docker info | '
+        'awk \'/[[:blank:]]*Context/ '
+        '{ split($0,a,":"); gsub(/[[:blank:]]/,"",a[2]); print a[2] }\''
+    )
+    return read_terminal(
+        'docker context ls | '
+        f'awk \'$1=="{context}" '
+        '{ for(i=1;i<=NF;i++) { if($i~/.*\\.sock/) { print $i } } }\''
+    )
+
 
+class Client:
+    def __init__(self, base_url: str | None = None, cpus: float = 1):
+        endpoint = base_url or os.getenv('DOCKER_HOST') or _context_endpoint()
         self.client = docker.DockerClient(base_url=endpoint)
         self.service = 'invoker'
+        self.cpus = cpus
 
         with open('invoker/Dockerfile') as df:
             dockerfile = df.readlines()
@@ -58,7 +82,26 @@ class Client:
     def containers(self) -> ContainersHolder:
         image = self.image
         containers = self.client.containers.list(all=True, filters={'ancestor': image.id})
-        return ContainersHolder(containers)
+        return ContainersHolder(containers, self.client.info()['NCPU'])
+
+    def scale_up(self, count: int):
+        image = self.image
+        for _ in range(count):
+            self.client.containers.run(
+                image.id, detach=True,
+                ports={'80/tcp': None},
+                labels={'service': self.service},
+                nano_cpus=int(self.cpus * 10 ** 9),
+                log_config={'type': 'json-file', 'config': {'max-size': '100m'}}
+            )
+
+    def restart(self, id_: str):
+        self.client.containers.get(id_).restart(timeout=5)
+
+    def retire(self, id_: str):
+        container = self.client.containers.get(id_)
+        container.stop(timeout=5)
+        container.remove()
 
 
 if __name__ == '__main__':
@@ -1,72 +1,144 @@
-"""
-TODO
-UNSUPPORTED, PLEASE USE mp.py FOR NOW
-"""
-
 import ast
 import os
-import pickle
 import subprocess
 import sys
+from pathlib import Path
+from queue import Queue
 from typing import Any
 
+from common.logging import setup_logging
+from common.testsys import wire
 from invoker.common import InvokerServiceBase
 
+ROOT = Path(__file__).parent.parent.parent
+
 READER = '''
-import pickle
-import sys
+import sys as _invoker_sys
+from common.testsys import wire as _invoker_wire
 
-args = pickle.load(sys.stdin, encoding='utf-8')
+_invoker_args = _invoker_wire.loads(memoryview(_invoker_sys.stdin.buffer.read())[_invoker_wire.HEADER.size:])
 '''
 
 WRITER = '''
-pickle.dump(RESULT, sys.stdout, encoding='utf-8')
-sys.stdout.flush()
+try:
+    _invoker_result = _invoker_wire.pack({{'verdict': 'OK', 'value': {call}}})
+except _invoker_wire.WireError as _invoker_error:
+    _invoker_result = _invoker_wire.pack({{'verdict': 'IA', 'message': f'answer can not be transferred: {{_invoker_error}}'}})
+_invoker_sys.stdout.buffer.write(_invoker_result)
+_invoker_sys.stdout.flush()
 '''
 
 
+def parse_meta(text: str) -> dict[str, str]:
+    meta = {}
+    for line in text.splitlines():
+        key, _, value = line.partition(':')
+        meta[key] = value
+    return meta
+
+
 class InvokerISO(InvokerServiceBase):
-    def run(self, source: ast.AST, args: tuple, time_limit: int, response: dict[str, Any]):
-        os.system('isolate --init')
+    BOX_OFFSET = int(os.getenv('INVOKER_BOX_OFFSET', '0'))
+    MOUNT = '/botts'
 
-        fn_name = InvokerServiceBase._extract_function_name(source)
-        text_source = ast.unparse(source)
-        with open('/tmp/sol.py', 'w') as solution:
-            solution.write('\n'.join([
-                READER,
-                text_source,
-                f'value = {fn_name}(*args)',
-                WRITER
-            ]))
+    def __init__(self, port: int):
+        super().__init__(port)
+        self.boxes: Queue[int] = Queue()
+        for box_id in range(InvokerISO.BOX_OFFSET, InvokerISO.BOX_OFFSET + InvokerServiceBase.SANDBOXES):
+            self.boxes.put(box_id)
+
+    @staticmethod
+    def _isolate(box_id: int, *args: str) -> subprocess.CompletedProcess:
+        return subprocess.run(['isolate', f'--box-id={box_id}', *args], capture_output=True, text=True)
 
+    def run(
+            self, source: ast.AST, args: tuple, time_limit: int, response: dict[str, Any],
+            memory_limit: int | None = None
+    ):
+        box_id = self.boxes.get()
         try:
-            process = subprocess.Popen([
-                'isolate', '--run', 'python', '/tmp/solution.py',
-                '--meta=/tmp/meta', f'--time={time_limit}', '--wall-time=10'
-            ], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-            process.stdin.write(pickle.dumps(args, encoding='utf-8'))
-            try:
-                result = {'verdict': 'OK', 'value': pickle.loads(process.stdout.read())}
-            except pickle.UnpicklingError as e:
-                result = {'verdict': 'CF', 'message': f'Invalid data in output stream: \'{e}\''}
-            exit_code = process.returncode
-        except Exception as e:
-            exit_code = None
-            result = {'verdict': 'CF', 'message': f'failed to start process: \'{e}\''}
-
-        if result['verdict'] != 'CF':
-            if exit_code == 1:
-                result = {'verdict': 'RE', 'message': 'TODO'}  # TODO parse meta file
-            # TODO parse meta file for TL info
-            if False:
-                response['verdict'] = 'TL'
-                response['message'] = f'took more than {time_limit}s to complete'
-
-        response.update(result)
-        os.system('isolate --cleanup')
+            response.update(self._run_in_box(box_id, source, args, time_limit, memory_limit))
+        finally:
+            InvokerISO._isolate(box_id, '--cleanup')
+            self.boxes.put(box_id)
         self.logger.info('Testing complete')
 
+    def _run_in_box(
+            self, box_id: int, source: ast.AST, args: tuple, time_limit: int, memory_limit: int | None
+    ) -> dict[str, Any]:
+        InvokerISO._isolate(box_id, '--cleanup')
+        init = InvokerISO._isolate(box_id, '--init')
+        if init.returncode != 0:
+            return {'verdict': 'CF', 'message': f'could not initialize sandbox: {init.stderr.strip()}'}
+        box = Path(init.stdout.strip()) / 'box'
+        meta_path = Path(f'/tmp/isolate-meta-{box_id}')
+
+        fn_name = InvokerServiceBase._extract_function_name(source)
+        (box / 'solution.py').write_text('\n'.join([
+            READER,
+            ast.unparse(source),
+            WRITER.format(call=f'{fn_name}(*_invoker_args)')
+        ]))
+        (box / 'input').write_bytes(wire.pack(args))
+
+        options = [
+            f'--meta={meta_path}',
+            f'--time={time_limit}',
+            f'--wall-time={InvokerServiceBase.wall_limit(time_limit)}',
+            f'--dir={InvokerISO.MOUNT}={ROOT}',
+            f'--env=PYTHONPATH={InvokerISO.MOUNT}',
+            '--stdin=input', '--stdout=output', '--stderr=error'
+        ]
+        if memory_limit is not None:
+            options.append(f'--mem={memory_limit << 10}')
+        InvokerISO._isolate(box_id, *options, '--run', '--', sys.executable, 'solution.py')
+
+        try:
+            meta = parse_meta(meta_path.read_text())
+        except OSError as e:
+            return {'verdict': 'CF', 'message': f'sandbox produced no meta file: {e}'}
+        finally:
+            meta_path.unlink(missing_ok=True)
+        stats = {
+            'cpu_time': float(meta.get('time', 0)),
+            'wall_time': float(meta.get('time-wall', 0)),
+            'max_rss': int(meta.get('max-rss', 0))
+        }
+        return stats | self._verdict(meta, box, time_limit, memory_limit)
+
+    @staticmethod
+    def _verdict(meta: dict[str, str], box: Path, time_limit: int, memory_limit: int | None) -> dict[str, Any]:
+        status = meta.get('status')
+        errors = (box / 'error').read_text(errors='replace').strip().splitlines()
+        last_error = errors[-1] if errors else meta.get('message', '')
+
+        if status == 'XX':
+            return {'verdict': 'CF', 'message': f'sandbox failure: {meta.get("message")}'}
+        if status == 'TO':
+            clock = 'wall clock' if 'wall' in meta.get('message', '') else 'CPU'
+            return {'verdict': 'TL', 'message': f'took more than {time_limit}s of {clock} time to complete'}
+        out_of_memory = meta.get('cg-oom-killed') == '1' or 'MemoryError' in last_error or (
+                memory_limit is not None and int(meta.get('max-rss', 0)) >= memory_limit << 10
+        )
+        if status in ('RE', 'SG') and out_of_memory:
+            if memory_limit is not None:
+                return {'verdict': 'ML', 'message': f'used more than {memory_limit} MiB of memory'}
+            return {'verdict': 'ML', 'message': 'ran out of memory'}
+        if status == 'RE':
+            return {'verdict': 'RE', 'message': f'runtime error \'{last_error}\''}
+        if status == 'SG':
+            return {'verdict': 'RE', 'message': f'killed by signal {meta.get("exitsig")}'}
+
+        try:
+            result = wire.loads(memoryview((box / 'output').read_bytes())[wire.HEADER.size:])
+        except (OSError, wire.WireError) as e:
+            return {'verdict': 'RE', 'message': f'malformed result: {e}'}
+        if wire.check(result, wire.RESPONSE) is not None:
+            return {'verdict': 'RE', 'message': 'malformed result'}
+        return result
+
 
 if __name__ == '__main__':
+    setup_logging()
     port = int(sys.argv[1])
     InvokerISO(port).start()
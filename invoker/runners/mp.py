@@ -1,173 +1,382 @@
 import ast
-import pickle
-import socket
-from dataclasses import dataclass, field
-from multiprocessing import Process, Queue
-from typing import Any
+import marshal
+import math
+import multiprocessing
+import os
+import resource
+import select
+import signal
+import sys
+import threading
+import time
+from multiprocessing.connection import Connection
+from queue import Queue
+from typing import Any, Callable
 
 from common.logging import setup_logging
-from invoker.common import InvokerServiceBase
+from common.testsys import fixtures, wire
+from common.testsys.runner import Verdict
+from invoker.common import Cancelled, Emitter, InvokerServiceBase, Request
 
 
-@dataclass
-class Request:
-    executor: str | None
-    source: str
-    args: tuple
-    time_limit: int = field(default=1)
+def _write_frame(fd: int, package: bytes | bytearray):
+    view = memoryview(package)
+    while view:
+        view = view[os.write(fd, view):]
 
 
-class Invoker(InvokerServiceBase):
-    def run(self, source: ast.AST, args: tuple, time_limit: int, response: dict[str, Any]):
-        fn_name = None
-        for node in ast.walk(source):
-            if isinstance(node, ast.FunctionDef):
-                fn_name = node.name
-                break
+def _read_exactly(fd: int, buffer: memoryview, deadline: float | None) -> bool:
+    received = 0
+    while received < len(buffer):
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+                raise TimeoutError()
+        count = os.readv(fd, [buffer[received:]])
+        if count == 0:
+            return False
+        received += count
+    return True
 
-        if not isinstance(source, ast.Module):
-            source = ast.Module(body=[source])
 
-        try:
-            code = compile(source, filename='<ast>', mode='exec')
-            evaluate = ast.parse(f'{fn_name}(*args)', mode='eval')
-            expr = compile(evaluate, filename='<ast>', mode='eval')
-        except SyntaxError as e:
-            response['verdict'] = 'RE'
-            response['message'] = f'Could not compile: \'{e}\''
+def _read_frame(fd: int, deadline: float | None) -> bytearray | None:
+    header = bytearray(wire.HEADER.size)
+    if not _read_exactly(fd, memoryview(header), deadline):
+        return None
+    package = header + bytearray(wire.unpack_header(header))
+    if not _read_exactly(fd, memoryview(package)[wire.HEADER.size:], deadline):
+        return None
+    return package
+
 
-        queue = Queue()
+def _limit_memory(memory_limit: int | None):
+    # The limit covers what the solution allocates on top of the already loaded interpreter
+    if memory_limit is None:
+        return
+    with open('/proc/self/status') as status:
+        size = next(int(line.split()[1]) for line in status if line.startswith('VmSize:')) << 10
+    limit = size + (memory_limit << 20)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
 
-        # noinspection PyUnusedLocal
-        def __evaluate(queue, code, expr, args):
+
+def _memory_exceeded(memory_limit: int | None) -> dict[str, Any]:
+    if memory_limit is None:
+        return {'verdict': 'ML', 'message': 'ran out of memory'}
+    return {'verdict': 'ML', 'message': f'used more than {memory_limit} MiB of memory'}
+
+
+# noinspection PyBroadException
+def _fork_test(
+        namespace: dict[str, Any], expr, args: tuple, time_limit: int, memory_limit: int | None, output_fd: int
+) -> tuple[bytes | bytearray, bool, dict[str, Any]]:
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            os.close(read_fd)
+            os.close(output_fd)
+            cpu_limit = math.ceil(time_limit)
+            resource.setrlimit(resource.RLIMIT_CPU, (cpu_limit, cpu_limit + 1))
             try:
-                exec(code, globals())
-            except Exception as e:
-                queue.put({
-                    'verdict': 'RE',
-                    'message': f'could not run: \'{e}\''
-                })
-                return
+                result = {'verdict': 'OK', 'value': eval(expr, namespace, {'args': args})}
+            except MemoryError:
+                result = _memory_exceeded(memory_limit)
+            except BaseException as e:
+                result = {'verdict': 'RE', 'message': f'runtime error \'{e}\''}
             try:
-                value = eval(expr, globals(), locals())
-                queue.put({
-                    'verdict': 'OK',
-                    'value': value
-                })
-            except Exception as e:
-                message = f'runtime error \'{e}\''
-                queue.put({
-                    'verdict': 'RE',
-                    'message': message
-                })
-
-        process = Process(target=__evaluate, args=(queue, code, expr, args))
-        process.start()
-        process.join(time_limit)
-        if process.is_alive():
-            self.logger.info('Solution timed out')
-            queue.close()
-            process.terminate()
-            self.logger.info('Process terminated')
-            response['verdict'] = 'TL'
-            response['message'] = f'took more than {time_limit}s to complete'
-        elif not queue.empty():
-            result = queue.get()
-            response.update(result)
-            self.logger.info('Testing complete')
-
-    def validate(self, input_data: str | bytes, response: dict[str, Any]) -> Request | None:
-        try:
-            request = pickle.loads(input_data)
-            self.logger.info(f'Received data parsed into {request}')
-        except pickle.UnpicklingError as e:
-            self.logger.warning(f'Request is malformed: not parseable by `pickle`, {e}')
-            response['error'] = f'expected a valid pickle, got {input_data}'
-            return
-        if not isinstance(request, dict):
-            self.logger.warning('Request is malformed: not a dictionary')
-            response['error'] = f'expected a dictionary, got {request}'
-            return
-        if 'source' not in request or 'args' not in request:
-            self.logger.warning(f'Request is malformed: not enough fields')
-            response['error'] = 'expected keys \'source\' and \'args\' in request'
+                package = wire.pack(result)
+            except wire.WireError as e:
+                result = {'verdict': 'IA', 'message': f'answer can not be transferred: {e}'}
+                package = wire.pack(result)
+            _write_frame(write_fd, package)
+            code = 0 if result['verdict'] == 'OK' else 1
+        finally:
+            os._exit(code)
+
+    os.close(write_fd)
+    started, failure = time.monotonic(), None
+    wall_limit = InvokerServiceBase.wall_limit(time_limit)
+    try:
+        package = _read_frame(read_fd, started + wall_limit)
+    except TimeoutError:
+        os.kill(pid, signal.SIGKILL)
+        package = None
+        failure = {'verdict': 'TL', 'message': f'took more than {wall_limit}s of wall clock time to complete'}
+    except wire.WireError as e:
+        os.kill(pid, signal.SIGKILL)
+        package, failure = None, {'verdict': 'RE', 'message': f'malformed result: {e}'}
+    finally:
+        os.close(read_fd)
+
+    _, status, rusage = os.wait4(pid, 0)
+    code = os.waitstatus_to_exitcode(status)
+    usage = {
+        'cpu_time': rusage.ru_utime + rusage.ru_stime,
+        'wall_time': time.monotonic() - started,
+        'max_rss': rusage.ru_maxrss
+    }
+    if usage['cpu_time'] > time_limit or code == -signal.SIGXCPU:
+        failure = {'verdict': 'TL', 'message': f'took more than {time_limit}s of CPU time to complete'}
+    elif failure is None and package is None:
+        failure = {'verdict': 'RE', 'message': f'process exited with code {code}'}
+    if failure is not None:
+        return wire.pack(failure), False, usage
+    return package, code == 0, usage
+
+
+def _warm_run(output_fd: int, code, expr, tests: list[tuple], time_limit: int, memory_limit: int | None):
+    _write_frame(output_fd, wire.pack({'pid': os.getpid()}))
+    os.setpgrp()
+    _limit_memory(memory_limit)
+    namespace = {'__name__': '__main__'}
+    try:
+        exec(code, namespace)
+    except MemoryError:
+        _write_frame(output_fd, wire.pack(_memory_exceeded(memory_limit)))
+        return
+    except Exception as e:
+        _write_frame(output_fd, wire.pack({'verdict': 'RE', 'message': f'could not run: \'{e}\''}))
+        return
+
+    for args in tests:
+        package, ok, usage = _fork_test(namespace, expr, args, time_limit, memory_limit, output_fd)
+        _write_frame(output_fd, wire.pack({'usage': usage}))
+        _write_frame(output_fd, package)
+        if not ok:
             return
-        if not isinstance(request['args'], tuple):
-            self.logger.warning(f'Request is malformed: invalid input data')
-            response['error'] = f'expected request[\'args\'] to be a tuple, got {request["args"]}'
+
+
+def _work(commands: Connection, results: Connection):
+    command_fd, result_fd = commands.fileno(), results.fileno()
+    while (package := _read_frame(command_fd, None)) is not None:
+        job = wire.loads(memoryview(package)[wire.HEADER.size:])
+        try:
+            tests = [fixtures.resolve(args) for args in job['tests']]
+        except fixtures.FixtureError as e:
+            _write_frame(result_fd, wire.pack({'error': str(e)}))
+            continue
+
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                os.close(command_fd)
+                code, expr = marshal.loads(job['code']), marshal.loads(job['expr'])
+                _warm_run(result_fd, code, expr, tests, job['time_limit'], job['memory_limit'])
+                status = 0
+            except SystemExit as e:
+                status = e.code if isinstance(e.code, int) else 1
+            finally:
+                os._exit(status)
+        _, status = os.waitpid(pid, 0)
+        _write_frame(result_fd, wire.pack({'exit': os.waitstatus_to_exitcode(status)}))
+
+
+class _Worker:
+    def __init__(self, context: multiprocessing.context.BaseContext):
+        command_reader, self.commands = context.Pipe(duplex=False)
+        self.results, result_writer = context.Pipe(duplex=False)
+        self.process = context.Process(target=_work, args=(command_reader, result_writer), daemon=True)
+        self.process.start()
+        command_reader.close()
+        result_writer.close()
+        self.runs = 0
+        self.job_pid: int | None = None
+
+    def warm_up(self):
+        # The first job of a fresh worker pays for page faults and lazy imports, keep it off the critical path
+        self.submit({
+            'code': marshal.dumps(compile('', filename='<warm-up>', mode='exec')),
+            'expr': marshal.dumps(compile('None', filename='<warm-up>', mode='eval')),
+            'tests': [()],
+            'time_limit': 1,
+            'memory_limit': None
+        })
+        deadline = time.monotonic() + Invoker.WARMUP_GRACE + 1
+        while 'exit' not in self.receive(deadline):
+            pass
+        self.runs = 0
+
+    def submit(self, job: dict[str, Any]):
+        self.job_pid = None
+        self.runs += 1
+        _write_frame(self.commands.fileno(), wire.pack(job))
+
+    def poll(self, timeout: float) -> bool:
+        return bool(select.select([self.results], [], [], max(timeout, 0))[0])
+
+    def receive(self, deadline: float) -> Any:
+        package = _read_frame(self.results.fileno(), deadline)
+        if package is None:
+            return None
+        return wire.loads(memoryview(package)[wire.HEADER.size:])
+
+    def stop(self):
+        if self.job_pid is not None:
+            for kill in (os.killpg, os.kill):
+                try:
+                    kill(self.job_pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+        self.process.kill()
+        self.process.join()
+        self.commands.close()
+        self.results.close()
+
+
+class _WorkerPool:
+    def __init__(self, size: int, runs: int):
+        self.context = multiprocessing.get_context('forkserver')
+        self.context.set_forkserver_preload([__name__])
+        self.runs = runs
+        self.idle: Queue[_Worker] = Queue()
+        for _ in range(size):
+            self.idle.put(self._spawn())
+
+    def _spawn(self) -> _Worker:
+        worker = _Worker(self.context)
+        worker.warm_up()
+        return worker
+
+    def _replace(self, worker: _Worker):
+        worker.stop()
+        self.idle.put(self._spawn())
+
+    def acquire(self) -> _Worker:
+        return self.idle.get()
+
+    def release(self, worker: _Worker, healthy: bool):
+        if healthy and worker.runs < self.runs:
+            self.idle.put(worker)
             return
+        threading.Thread(target=self._replace, args=(worker,), daemon=True).start()
+
+
+class Invoker(InvokerServiceBase):
+    FORK_PER_TEST = os.getenv('INVOKER_FORK_PER_TEST', '1') == '1'
+    POOL_SIZE = int(os.getenv('INVOKER_WORKERS', '0')) or InvokerServiceBase.SANDBOXES
+    WORKER_RUNS = int(os.getenv('INVOKER_WORKER_RUNS', '64'))
+    ACCEPT = tuple(os.getenv('INVOKER_ACCEPT', '172.').split(','))
+    WARMUP_GRACE = 1
+    CANCEL_POLL = 0.1
+
+    def __init__(self, port: int):
+        super().__init__(port)
+        self.workers: _WorkerPool | None = None
+
+    def _resolve_fixtures(self, request: Request):
+        # Workers load fixtures themselves and keep them cached between jobs
+        pass
+
+    def run(
+            self, source: ast.AST, args: tuple, time_limit: int, response: dict[str, Any],
+            memory_limit: int | None = None
+    ):
+        self._dispatch(source, [args], time_limit, response.update, memory_limit, lambda: False)
+        response.pop('index', None)
+
+    def run_batch(
+            self, source: ast.AST, tests: list[tuple], time_limit: int,
+            emit: Emitter, memory_limit: int | None = None
+    ):
+        if not Invoker.FORK_PER_TEST:
+            return super().run_batch(source, tests, time_limit, emit, memory_limit)
+        self._dispatch(source, tests, time_limit, emit, memory_limit, lambda: emit.cancelled)
+
+    def _dispatch(
+            self, source: ast.AST, tests: list[tuple], time_limit: int,
+            emit: Callable[[dict[str, Any]], None], memory_limit: int | None,
+            cancelled: Callable[[], bool]
+    ):
+        fn_name = InvokerServiceBase._extract_function_name(source)
+        if not isinstance(source, ast.Module):
+            source = ast.Module(body=[source])
 
-        source = request['source']
         try:
-            if 'executor' in request and request['executor'] is not None:
-                source = request['source'] + '\n' + request['executor']
-            ast.parse(source)
+            code = compile(source, filename='<ast>', mode='exec')
+            expr = compile(ast.parse(f'{fn_name}(*args)', mode='eval'), filename='<ast>', mode='eval')
         except SyntaxError as e:
-            self.logger.warning(f'Request is malformed: source is not a valid code but {source}')
-            response['error'] = f'expected a valid code, but have {e}'
+            emit({'index': 0, 'verdict': 'RE', 'message': f'Could not compile: \'{e}\''})
             return
-        return Request(**request)
-
-    def process(self, conn: socket.socket):
-        def read(size: int):
-            data = bytes()
-            while len(data) < size:
-                data += conn.recv(Invoker.BATCH_SIZE)
-            return data[:size]
-
-        with conn:
-            size = int.from_bytes(conn.recv(8))
-            input_data = read(size)
-            response = {}
-            self.logger.info(f'Received request {input_data}')
-            request = self.validate(input_data, response)
-            if request:
-                source = request.source
-                if request.executor is not None:
-                    ex = ast.parse(request.executor)
-                    ex_name = None
-                    for node in ast.walk(ex):
-                        if isinstance(node, ast.FunctionDef):
-                            ex_name = node.name
-                            break
-
-                    src = ast.parse(source)
-                    fn_name = None
-                    for node in ast.walk(src):
-                        if isinstance(node, ast.FunctionDef):
-                            fn_name = node.name
-                            break
-
-                    source = '\n'.join([
-                        source,
-                        request.executor,
-                        f'{fn_name} = {ex_name}({fn_name})'
-                    ])
-                fn = ast.parse(source)
-                self.run(fn, request.args, request.time_limit, response)
-                self.logger.info(f'Run successful, response is {response}')
-
-            response['package'] = pickle.dumps(response)
-            conn.send(len(response['package']).to_bytes(8))
-            conn.send(response['package'])
-            conn.close()
+
+        worker = self.workers.acquire()
+        healthy = False
+        try:
+            worker.submit({
+                'code': marshal.dumps(code),
+                'expr': marshal.dumps(expr),
+                'tests': tests,
+                'time_limit': time_limit,
+                'memory_limit': memory_limit
+            })
+            healthy = self._collect(worker, len(tests), time_limit, emit, cancelled)
+        finally:
+            self.workers.release(worker, healthy)
+
+    def _collect(
+            self, worker: _Worker, count: int, time_limit: int,
+            emit: Callable[[dict[str, Any]], None], cancelled: Callable[[], bool]
+    ) -> bool:
+        i = 0
+        usage = {}
+        while True:
+            deadline = time.monotonic() + InvokerServiceBase.wall_limit(time_limit) + Invoker.WARMUP_GRACE
+            try:
+                while not worker.poll(min(deadline - time.monotonic(), Invoker.CANCEL_POLL)):
+                    if cancelled():
+                        raise Cancelled()
+                    if time.monotonic() >= deadline:
+                        raise TimeoutError()
+                message = worker.receive(deadline)
+            except TimeoutError:
+                self.logger.info('Solution timed out')
+                wall_limit = InvokerServiceBase.wall_limit(time_limit)
+                emit({'index': i, 'verdict': 'TL', 'message': f'took more than {wall_limit}s of wall clock time to complete'})
+                return False
+            except wire.WireError as e:
+                emit({'index': i, 'verdict': 'RE', 'message': f'malformed result: {e}'})
+                return False
+
+            if message is None:
+                emit({'index': i, 'verdict': 'RE', 'message': 'worker exited unexpectedly'})
+                return False
+            if 'pid' in message:
+                worker.job_pid = message['pid']
+                continue
+            if 'usage' in message:
+                usage = message['usage']
+                continue
+            if 'error' in message:
+                emit({'error': message['error']})
+                return True
+            if 'exit' in message:
+                if i < count:
+                    emit({'index': i, 'verdict': 'RE', 'message': f'process exited with code {message["exit"]}'})
+                    return False
+                self.logger.info('Testing complete')
+                return True
+
+            if wire.check(message, wire.RESPONSE) is not None or message.get('verdict') not in Verdict.__members__:
+                emit({'index': i, 'verdict': 'RE', 'message': 'malformed result'})
+                return False
+            emit(message | usage | {'index': i})
+            usage = {}
+            if message['verdict'] != 'OK':
+                return False
+            i += 1
 
     def start(self):
-        self.logger.info('Starting service...')
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.bind((self.host, self.port))
-            s.listen()
-            self.logger.info('Bind successful')
-            while True:
-                conn, addr = s.accept()
-                self.logger.info(f'Connection by {addr}')
-                if not addr[0].startswith('172.'):
-                    self.logger.info('Not a host IP, ignoring connection')
-                    conn.close()
-                else:
-                    self.process(conn)
+        self.workers = _WorkerPool(Invoker.POOL_SIZE, Invoker.WORKER_RUNS)
+        super().start()
+
+    def health(self) -> dict[str, Any]:
+        return super().health() | {'idle_workers': self.workers.idle.qsize()}
+
+    def accepts(self, addr: tuple[str, int]) -> bool:
+        return addr[0].startswith(Invoker.ACCEPT)
 
 
 if __name__ == '__main__':
     setup_logging()
-    Invoker(80).start()
+    Invoker(int(sys.argv[1]) if len(sys.argv) > 1 else 80).start()